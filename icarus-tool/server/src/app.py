@@ -1,14 +1,60 @@
-from flask import Flask, jsonify, make_response, send_from_directory
+import re
+from fractions import Fraction
+from typing import Optional
+
+from flask import Flask, jsonify, make_response, request, send_from_directory
 from flask_cors import CORS, cross_origin
 
 from application import Application
-from calculator import Equation
+from cache import PersistentCache, ResultCache, hash_files, hash_key
+from calculator import (
+    Calculator,
+    Equation,
+    ExplicitPolicy,
+    OptimalPolicy,
+    Policy,
+    Resource,
+    Validator,
+    policies,
+)
 
 app = Flask(__name__, static_url_path="/", static_folder="../../client/build")
 app.config["CORS_HEADERS"] = "Content-Type"
 
+# Limits of the result cache, e.g. FLASK_RESULT_CACHE_ENTRIES=1024
+app.config["RESULT_CACHE_ENTRIES"] = 256
+app.config["RESULT_CACHE_BYTES"] = 16 * 1024 * 1024
+
+# Outputs are also shared by workers in a file, e.g. FLASK_RESULT_CACHE_FILE=results.db
+app.config["RESULT_CACHE_FILE"] = None
+
+# Tech tree is loaded from an up to date snapshot, e.g. FLASK_SNAPSHOT=true
+app.config["SNAPSHOT"] = False
+app.config.from_prefixed_env()
+
 cors = CORS(app)
 
+# Tech tree is read once per worker and shared by every request.
+# Requests resolve recipes on overlays which never change the shared recipes.
+tech_tree = Application()
+if app.config["SNAPSHOT"]:
+    tech_tree.init(["app.py", "-s", "data/tech_tree.txt"])
+else:
+    tech_tree.init(["app.py", "data/tech_tree.txt"])
+
+# Outputs of popular queries are rendered once per version of the recipes.
+results = ResultCache(
+    app.config["RESULT_CACHE_ENTRIES"], app.config["RESULT_CACHE_BYTES"]
+)
+
+# Outputs in the file are valid as long as the data files do not change.
+persistent: Optional[PersistentCache] = None
+data_hash = ""
+if app.config["RESULT_CACHE_FILE"]:
+    data_hash = hash_files(tech_tree.files)
+    persistent = PersistentCache(app.config["RESULT_CACHE_FILE"])
+    persistent.invalidate(data_hash)
+
 
 @app.route("/")
 @cross_origin()
@@ -23,8 +69,8 @@ def get_data():
 
 @app.route("/api/plaintext/<user_input>")
 def plaintext(user_input: str):
-    config: list[str] = ["app.py", "-i", "-r", "data/tech_tree.txt"]
-    output: list[str] = handle_request(config, user_input)
+    config: list[str] = ["app.py", "-i", "-r"]
+    output: list[str] = handle_request(config, user_input, request.args)
 
     response = make_response("\n".join(output))
     response.mimetype = "text/plain"
@@ -34,29 +80,118 @@ def plaintext(user_input: str):
 @app.route("/api/json")
 @cross_origin()
 def json_all():
-    application = Application()
-    application.init(["app.py", "-i", "-r", "data/tech_tree.txt"])
-    array = list(application.calculator.resources)
+    array = list(tech_tree.calculator.resources)
     return jsonify(array)
 
 
+@app.route("/api/json/where-used/<name>")
+@cross_origin()
+def where_used(name: str):
+    calculator = tech_tree.calculator
+
+    # Unknown resources are not found rather than never used.
+    try:
+        calculator.validator.validate_value_names(Equation([Resource((1, name))]))
+    except ValueError as err:
+        return make_response(jsonify({"error": str(err)}), 404)
+
+    used = calculator.where_used(name)
+    return jsonify({"name": name, **used})
+
+
+@app.route("/api/cache")
+@cross_origin()
+def cache_stats():
+    return jsonify(results.stats())
+
+
 @app.route("/api/json/<user_input>")
 @cross_origin()
 def make_json(user_input: str):
-    config: list[str] = ["app.py", "-i", "-j", "data/tech_tree.txt"]
-    output: list[str] = handle_request(config, user_input)
+    config: list[str] = ["app.py", "-i", "-j"]
+    output: list[str] = handle_request(config, user_input, request.args)
 
     response = make_response("\n".join(output))
     response.mimetype = "application/json"
     return response
 
 
-def handle_request(config: list[str], user_input: str) -> list[str]:
-    application = Application()
+def get_weights(calculator: Calculator, value: str) -> dict[str, Fraction]:
+    """
+    Weights of raw materials for the optimal policy.
+
+    Example: iron_ore:2,wood:1/2 -> {"iron_ore": 2, "wood": 1/2}
+    """
+
+    weights: dict[str, Fraction] = dict()
+    for weight in filter(None, value.split(",")):
+        name, _, amount = weight.partition(":")
+        valid = re.fullmatch(Validator.pattern_num, amount)
+        if name not in calculator.variables or not valid:
+            raise ValueError("ValueError: weights=" + weight)
+        weights[name] = Validator.to_amount(amount)
+    return weights
+
+
+def get_policy(calculator: Calculator, args: dict[str, str]) -> Policy:
+    """
+    Recipe options are chosen by query parameters.
+    Other parameters choose an option of a single resource by its index.
+
+    Example: ?policy=cheapest&concrete_mix=1
+    Example: ?policy=optimal&weights=iron_ore:2,wood:1/2
+    """
+
+    choices = dict(args)
+    name = choices.pop("policy", "first")
+    if name not in policies:
+        raise ValueError("ValueError: policy=" + name)
+
+    # Only the optimal policy weighs raw materials.
+    weights = get_weights(calculator, choices.pop("weights", ""))
+    if weights and policies[name] is not OptimalPolicy:
+        raise ValueError("ValueError: weights=" + args["weights"])
+
+    if weights:
+        policy: Policy = OptimalPolicy(calculator, weights)
+    else:
+        policy = policies[name](calculator)
+    if choices:
+        return ExplicitPolicy(calculator, choices, policy)
+    return policy
+
+
+def handle_request(
+    config: list[str], user_input: str, args: Optional[dict[str, str]] = None
+) -> list[str]:
+    # Command line options configure the algorithm of a single request.
+    application = tech_tree.overlay()
     application.init(config)
 
+    # Outputs are dropped when the shared recipes are changed or replaced.
+    key: Optional[tuple] = None
+    version = (id(tech_tree.calculator), tech_tree.calculator.version)
     try:
-        equation: Equation = application.parse_input(user_input)
+        # Web server cannot ask the user which recipe to use.
+        # Policy works on the overlay, so the shared recipes are never written.
+        policy = get_policy(application.calculator, args or {})
+        application.callback = policy
+
+        # Terms are merged and sorted, so variants of a query are computed once.
+        # Canonical form is also calculated, so every variant gets the same output.
+        equation: Equation = application.parse_input(user_input).canonical()
+
+        # Same query with the same options always gives the same output.
+        key = (tuple(config), str(equation), policy.key)
+        if (cached := results.get(key, version)) is not None:
+            return cached
+
+        # Another worker may have calculated the output already.
+        cached = persistent.get(hash_key(*key), data_hash) if persistent else None
+        if cached is not None:
+            results.put(key, cached, version)
+            return cached
+
         equation = application.preprocessor.process(equation)
         output: list[str] = application.algorithm.calculate(equation)
     except SyntaxError as err:
@@ -66,6 +201,11 @@ def handle_request(config: list[str], user_input: str) -> list[str]:
         output = application.recover(user_input)
         output.insert(0, str(err))
 
+    if key is not None:
+        results.put(key, output, version)
+        if persistent:
+            persistent.put(hash_key(*key), output, data_hash)
+
     return output
 
 
@@ -2,10 +2,11 @@
 import json
 import sys
 from abc import ABC, abstractmethod
-from collections import deque
-from typing import Any
+from typing import Any, Callable, Iterator, Optional, TextIO
 
 from calculator import Calculator, Equation, EquationTree, Resource
+from snapshot import load_snapshot
+from solver import MatrixSolver, numpy
 
 
 class FileSystem:
@@ -28,21 +29,119 @@ class FileSystem:
                     calculator.assign_equation(line)
 
 
+class JsonStream:
+    """
+    Reads a json document one value at a time.
+    Only a chunk of the file and the current value are kept in memory.
+    """
+
+    decoder = json.JSONDecoder()
+
+    def __init__(self, file: TextIO, chunk_size: int = 64 * 1024):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        """Reads the next chunk and drops what has been consumed."""
+
+        if self.eof:
+            return False
+
+        chunk = self.file.read(self.chunk_size)
+        self.eof = chunk == ""
+        self.buffer = self.buffer[self.position :] + chunk
+        self.position = 0
+        return not self.eof
+
+    def peek(self) -> str:
+        """Returns the next character which is not whitespace."""
+
+        while True:
+            while self.position < len(self.buffer):
+                if not self.buffer[self.position].isspace():
+                    return self.buffer[self.position]
+                self.position += 1
+            if not self.fill():
+                return ""
+
+    def expect(self, characters: str) -> str:
+        character = self.peek()
+        if character == "" or character not in characters:
+            name = getattr(self.file, "name", "json")
+            raise ValueError("Expected %s in %s" % (characters, name))
+        self.position += 1
+        return character
+
+    def value(self) -> Any:
+        """Decodes the next value once it is completely in the buffer."""
+
+        self.peek()
+        while True:
+            try:
+                value, end = JsonStream.decoder.raw_decode(self.buffer, self.position)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+
+            # Number at the end of the buffer may continue in the next chunk.
+            if end < len(self.buffer) or not self.fill():
+                self.position = end
+                return value
+
+    def rows(self, key: str) -> Iterator[Any]:
+        """Yields the elements of an array in the top level object."""
+
+        self.expect("{")
+        while self.peek() != "}":
+            name = self.value()
+            self.expect(":")
+            if name != key:
+                self.value()  # Other values are skipped.
+            else:
+                self.expect("[")
+                while self.peek() != "]":
+                    yield self.value()
+                    if self.expect(",]") == "]":
+                        self.position -= 1
+                self.expect("]")
+            if self.expect(",}") == "}":
+                return
+
+
 class JsonSystem(FileSystem):
-    def __init__(self, filename: str):
+    # Only these fields of a recipe are kept.
+    fields: tuple[str, ...] = ("Name", "RecipeSets", "Inputs", "Outputs")
+
+    def __init__(self, filename: str, fields: Optional[tuple[str, ...]] = None):
         super().__init__(filename)
+        self.fields = fields or JsonSystem.fields
 
     def read(self, calculator: Calculator) -> None:
-        with open(self.filename) as file:
-            data = file.read()
-        recipes = json.loads(data)
-
-        for recipe in recipes["Rows"]:
+        for recipe in self.read_rows():
             try:
                 for line in JsonSystem.to_equation(recipe):
                     calculator.assign_equation(line)
             except IndexError:
-                calculator.errors.append(recipe)
+                # Recipe without inputs or outputs is not an equation.
+                missing = [k for k in ("Inputs", "Outputs") if not recipe.get(k)]
+                name = recipe.get("Name")
+                calculator.errors.append(f"{name}: no {' and '.join(missing)}")
+
+    def read_rows(self) -> Iterator[dict[str, Any]]:
+        """
+        Reads recipes one at a time and drops the unused fields,
+        so memory does not grow with the size of the file.
+
+        Example: ("Name", "RequiredMillijoules") -> {"Name": "Biofuel", "RequiredMillijoules": 5000}
+        """
+
+        with open(self.filename) as file:
+            for row in JsonStream(file).rows("Rows"):
+                yield {k: row[k] for k in self.fields if k in row}
 
     @classmethod
     def to_equation(cls, recipe: dict[str, Any]) -> list[str]:
@@ -85,7 +184,6 @@ class Completer:
             readline.set_completer(self.auto_complete)
         except ImportError as error:
             print(str(error))
-        
 
     def auto_complete(self, text: str, state: int):
         options = [var for var in self.keywords if var.startswith(text)]
@@ -97,7 +195,7 @@ class Completer:
 
 class Application:
     def __init__(self):
-        self.calculator = Calculator()
+        self.calculator: Calculator = Calculator()
 
         # Algorithm depends on command line arguments.
         self.algorithm: Algorithm = Iterative(self)
@@ -105,8 +203,25 @@ class Application:
         # Process the equation before applying the algorithm.
         self.preprocessor: Preprocessor = Explicit(self)
 
+        # Recipe options are asked from the user by default.
+        self.callback: Callable[[list[str]], int] = self.ask_optional
+
+        # Files which the recipes have been read from.
+        self.files: list[str] = []
+
         self.separator = "-" * 72
 
+    def overlay(self) -> "Application":
+        """
+        Returns an application which shares the recipes of this application.
+        Algorithm, preprocessor and callback are configured separately.
+        """
+
+        application = Application()
+        application.calculator = self.calculator.overlay()
+        application.files = list(self.files)
+        return application
+
     def manual(self, script: str):
         print()
         print("Usage:")
@@ -116,6 +231,9 @@ class Application:
         print("  -g --gnu          Apply GNU readline functionality to python's input.")
         print("  -i --implicit     Add all the necessary intermediate steps.")
         print("  -r --recursive    Show the output as a tree data structure.")
+        print("  -w --where-used   List the recipes which consume the resources.")
+        print("  -m --matrix       Calculate the total resources at once with NumPy.")
+        print("  -s --snapshot     Load the files from an up to date snapshot.")
         print("  -h --help         Show this user manual and exit.")
         print()
 
@@ -145,16 +263,20 @@ class Application:
         return equation
 
     def parse_input(self, equation: str) -> Equation:
-        # Validate an equation before processing any further.
-        self.calculator.validator.validate_syntax_calculation(equation)
-
-        equation_obj: Equation = Equation(equation)
+        # Validate and parse an equation before processing any further.
+        equation_obj: Equation = self.calculator.validator.parse_calculation(equation)
 
         # Ensure there are only pre-assigned variable names.
-        self.calculator.validator.validate_value_calculation(equation_obj)
+        self.algorithm.validate(equation_obj)
 
         return equation_obj
 
+    def point_error(self, err: SyntaxError) -> str:
+        """Marks the position where the input could not be parsed."""
+
+        offset = len("SyntaxError: ") + (err.offset or 1) - 1
+        return " " * offset + "^"
+
     def recover(self, user_input: str) -> list[str]:
         assert isinstance(user_input, str)
 
@@ -338,26 +460,37 @@ class Application:
         10 stone
         """
 
-        def traverse(root: EquationTree, count: int = 0, step: int = 2) -> None:
-            if root.data:
-                resource: Resource = root.data
-                message = " " * count + str(resource)
-                if root.station:
-                    message += " [%s]" % root.station
-                output.append(message)
-
-            for i, node in enumerate(root.children):
-                # Separate root elements from user input.
-                # Because they form different tree stuctures.
-                if i > 0 and not root.data:
+        def traverse(root: EquationTree, step: int = 2) -> None:
+            # Separator is pushed as a node without any tree.
+            stack: list[tuple[EquationTree | None, int]] = [(root, 0)]
+            while stack:
+                tree, count = stack.pop()
+                if tree is None:
                     output.append(separator)
-
-                # Do not increase indendation on empty root.
-                # Root node artificially connects user input.
-                if root.data:
-                    traverse(node, count + step)
-                else:
-                    traverse(node, count)
+                    continue
+
+                if tree.data:
+                    resource: Resource = tree.data
+                    message = " " * count + str(resource)
+                    if tree.station:
+                        message += " [%s]" % tree.station
+                    output.append(message)
+
+                nodes: list[tuple[EquationTree | None, int]] = []
+                for i, node in enumerate(tree.children):
+                    # Separate root elements from user input.
+                    # Because they form different tree stuctures.
+                    if i > 0 and not tree.data:
+                        nodes.append((None, count))
+
+                    # Do not increase indendation on empty root.
+                    # Root node artificially connects user input.
+                    if tree.data:
+                        nodes.append((node, count + step))
+                    else:
+                        nodes.append((node, count))
+
+                stack += reversed(nodes)
 
         output.append(separator.replace("-", "="))
         output.append("RECURSIVE DATA STRUCTURE")
@@ -385,6 +518,7 @@ class Application:
                 break
             except SyntaxError as err:
                 print(str(err))
+                print(self.point_error(err))
                 output = self.help()
             except ValueError as err:
                 print(str(err))
@@ -397,9 +531,27 @@ class Application:
         try:
             # Parse command line arguments.
             opts, args = getopt.getopt(
-                argv[1:], "girjh", ["gnu", "implicit", "recursive", "json", "help"]
+                argv[1:],
+                "girjwmsh",
+                [
+                    "gnu",
+                    "implicit",
+                    "recursive",
+                    "json",
+                    "where-used",
+                    "matrix",
+                    "snapshot",
+                    "help",
+                ],
             )
 
+            # Compiled snapshot of the same files is loaded when asked for.
+            snapshot = any(opt in ("-s", "--snapshot") for opt, _ in opts)
+            if snapshot and args and (calculator := load_snapshot(args)):
+                self.calculator = calculator
+                self.files += args
+                args = []
+
             for argument in args:
                 # Application class should create a file reader.
                 # Because is given as a command line argument.
@@ -414,6 +566,8 @@ class Application:
                     filesystem = FileSystem(argument)
                     filesystem.read(self.calculator)
 
+                self.files.append(argument)
+
             # Configure program based on options.
             for opt, arg in opts:
 
@@ -431,6 +585,18 @@ class Application:
                     algorithm = RecursiveJson(self)
                     self.algorithm = algorithm
 
+                if opt in ("-w", "--where-used"):
+                    algorithm = WhereUsed(self)
+                    self.algorithm = algorithm
+
+                # Other options are still applied without NumPy.
+                if opt in ("-m", "--matrix"):
+                    try:
+                        algorithm = Matrix(self)
+                        self.algorithm = algorithm
+                    except ImportError as err:
+                        print(str(err))
+
                 # Include all necessary workstations
                 if opt in ("-i", "--implicit"):
                     preprocessor = Implicit(self)
@@ -440,6 +606,10 @@ class Application:
                 if opt in ("-h", "--help"):
                     self.manual(argv[0])
 
+            # Consumers are listed through every option, so none is chosen.
+            if isinstance(self.algorithm, WhereUsed):
+                self.preprocessor = Unresolved(self)
+
         except getopt.GetoptError as err:
             print(str(err))
         except FileNotFoundError as err:
@@ -456,6 +626,9 @@ class Algorithm(ABC):
     def calculate(self, equation: Equation) -> list[str]:
         pass
 
+    def validate(self, equation: Equation) -> None:
+        self.application.calculator.validator.validate_value_calculation(equation)
+
 
 class Iterative(Algorithm):
     def calculate(self, equation: Equation) -> list[str]:
@@ -467,13 +640,33 @@ class Iterative(Algorithm):
 
 class Recursive(Algorithm):
     def calculate(self, equation: Equation) -> list[str]:
-        total = deque(self.application.calculator.calculate(equation), maxlen=1).pop()
+        total = self.application.calculator.calculate_total(equation)
         equation_tree = self.application.calculator.calculate_recursive(equation)
         output = self.application.print_output_recursive(equation_tree)
         output += self.application.print_total_resources(total, equation)
         return output
 
 
+class Matrix(Algorithm):
+    def __init__(self, application: Application):
+        super().__init__(application)
+        if numpy is None:
+            raise ImportError("No module named 'numpy'")
+        self.solver: Optional[MatrixSolver] = None
+
+    def calculate(self, equation: Equation) -> list[str]:
+        # Matrix is built again only after the recipes change.
+        calculator = self.application.calculator
+        solver = self.solver
+        if solver is None or solver.calculator is not calculator:
+            solver = None
+        if solver is None or solver.version != calculator.version:
+            solver = self.solver = MatrixSolver(calculator)
+
+        total = solver.calculate(equation)
+        return self.application.print_total_resources(total, equation)
+
+
 class RecursiveJson(Algorithm):
     def calculate(self, equation: Equation) -> list[str]:
         equation_tree = self.application.calculator.calculate_recursive(equation)
@@ -484,6 +677,56 @@ class RecursiveJson(Algorithm):
         return output
 
 
+class WhereUsed(Algorithm):
+    def calculate(self, equation: Equation) -> list[str]:
+        """
+        > 1 tree_sap + 1 potbelly_stove
+        ==================================
+        TREE SAP
+        ==================================
+        epoxy
+        blood_thinning_tonic
+        ...
+        ----------------------------------
+        steel_axe
+        steel_pickaxe
+        ...
+        ==================================
+        POTBELLY STOVE
+        ==================================
+        sweetcorn_soup [potbelly_stove]
+        stew [potbelly_stove]
+        ...
+        """
+
+        separator: str = self.application.separator
+        output: list[str] = []
+
+        for resource in equation:
+            used = self.application.calculator.where_used(resource.name)
+
+            output.append(separator.replace("-", "="))
+            output.append(resource.name.replace("_", " ").upper())
+            output.append(separator.replace("-", "="))
+
+            # Recipes which consume the resource directly.
+            output += used["ingredient"]
+            output += ["%s [%s]" % (name, resource.name) for name in used["station"]]
+
+            # Recipes further up in the tech tree.
+            direct = used["ingredient"] + used["station"]
+            indirect = [name for name in used["required"] if name not in direct]
+            if indirect:
+                output.append(separator)
+                output += indirect
+
+        return output
+
+    def validate(self, equation: Equation) -> None:
+        """Raw materials are valid input when looking for their consumers."""
+        self.application.calculator.validator.validate_value_names(equation)
+
+
 class Preprocessor(ABC):
     def __init__(self, application: Application):
         self.application = application
@@ -501,17 +744,23 @@ class Explicit(Preprocessor):
         """
 
         self.application.calculator.resolve_recipes(
-            equation, callback=self.application.ask_optional
+            equation, callback=self.application.callback
         )
         return equation
 
 
+class Unresolved(Preprocessor):
+    def process(self, equation: Equation) -> Equation:
+        """Options are left unresolved, so the recipes do not change."""
+        return equation
+
+
 class Implicit(Preprocessor):
     def process(self, equation: Equation) -> Equation:
         """Calculator extends input when deemed necessary."""
 
         self.application.calculator.resolve_recipes_implicit(
-            equation, callback=self.application.ask_optional
+            equation, callback=self.application.callback
         )
         return self.application.calculator.find_workstations(equation)
 
@@ -0,0 +1,198 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import closing
+from typing import Any, Hashable, Optional
+
+# Persistent outputs of an older format or calculation are never returned.
+# Increment the version whenever the same query gives a different output.
+CACHE_VERSION = 1
+
+
+class ResultCache:
+    """
+    Least recently used cache of rendered outputs.
+    Memory is bounded by the number of entries and by their total size.
+    Outputs are cached for a version of the data and dropped when it changes.
+    Cache is shared by threads so every operation holds a lock.
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+
+        self.entries: OrderedDict[Hashable, tuple[str, ...]] = OrderedDict()
+        self.sizes: dict[Hashable, int] = dict()
+        self.size = 0
+        self.version: Any = None
+
+        self.hits = 0
+        self.misses = 0
+
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, version: Any) -> Optional[list[str]]:
+        """Returns a copy of the output or None when it is not cached."""
+
+        with self.lock:
+            self.invalidate(version)
+
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return list(self.entries[key])
+
+    def put(self, key: Hashable, output: list[str], version: Any) -> None:
+        """Stores an output and evicts the least recently used ones."""
+
+        # Every line is followed by a line break when rendered.
+        size = sum(len(line.encode()) + 1 for line in output)
+
+        with self.lock:
+            self.invalidate(version)
+
+            # Output which alone exceeds the limit is never cached.
+            if size > self.max_bytes or self.max_entries <= 0:
+                return
+
+            if key in self.entries:
+                self.remove(key)
+
+            self.entries[key] = tuple(output)
+            self.sizes[key] = size
+            self.size += size
+
+            while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+                self.remove(next(iter(self.entries)))
+
+    def invalidate(self, version: Any) -> None:
+        """Drops every output when the data has changed. Lock must be held."""
+
+        if version != self.version:
+            self.entries.clear()
+            self.sizes.clear()
+            self.size = 0
+            self.version = version
+
+    def remove(self, key: Hashable) -> None:
+        """Lock must be held."""
+
+        del self.entries[key]
+        self.size -= self.sizes.pop(key)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.sizes.clear()
+            self.size = 0
+
+    def stats(self) -> dict[str, int]:
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+class PersistentCache:
+    """
+    Rendered outputs in an SQLite file shared by processes and threads.
+    Outputs are stored for a hash of the data files they were calculated from,
+    so outputs of changed files are never returned.
+    Every thread opens a connection of its own.
+    Cache is optional, so errors of the file are handled as misses
+    and a file which cannot be created disables the cache.
+    """
+
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.local = threading.local()
+        self.enabled = True
+
+        try:
+            with closing(sqlite3.connect(self.filename, timeout=10)) as connection:
+                with connection:
+                    connection.execute(
+                        "CREATE TABLE IF NOT EXISTS results "
+                        "(key TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                        "output TEXT NOT NULL)"
+                    )
+        except (sqlite3.Error, OSError):
+            self.enabled = False
+
+    def connect(self) -> sqlite3.Connection:
+        # Connection must not be used by a forked worker process either.
+        if getattr(self.local, "pid", None) != os.getpid():
+            connection = sqlite3.connect(self.filename, timeout=10)
+            # Readers are not blocked by a writer in another process.
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+            self.local.pid = os.getpid()
+        return self.local.connection
+
+    def get(self, key: str, data: str) -> Optional[list[str]]:
+        """Returns the output or None when it is not cached for the data."""
+
+        if not self.enabled:
+            return None
+
+        query = "SELECT output FROM results WHERE key = ? AND data = ?"
+        try:
+            row = self.connect().execute(query, (key, data)).fetchone()
+        except (sqlite3.Error, OSError):
+            return None
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put(self, key: str, output: list[str], data: str) -> None:
+        """Stores an output unless the file cannot be written."""
+
+        if not self.enabled:
+            return
+
+        try:
+            with self.connect() as connection:
+                connection.execute(
+                    "INSERT OR REPLACE INTO results VALUES (?, ?, ?)",
+                    (key, data, json.dumps(output)),
+                )
+        except (sqlite3.Error, OSError):
+            pass
+
+    def invalidate(self, data: str) -> None:
+        """Drops every output which was not calculated from the data."""
+
+        if not self.enabled:
+            return
+
+        try:
+            with self.connect() as connection:
+                connection.execute("DELETE FROM results WHERE data != ?", (data,))
+        except (sqlite3.Error, OSError):
+            # Outdated outputs are never returned anyway.
+            pass
+
+
+def hash_files(filenames: list[str]) -> str:
+    """Returns a hash of the contents of the files in the given order."""
+
+    digest = hashlib.sha256()
+    for filename in filenames:
+        with open(filename, "rb") as file:
+            digest.update(hashlib.sha256(file.read()).digest())
+    return digest.hexdigest()
+
+
+def hash_key(*parts: Any) -> str:
+    """Returns a key which is the same in every process and cache version."""
+
+    return hashlib.sha256(repr((CACHE_VERSION,) + parts).encode()).hexdigest()
@@ -1,13 +1,95 @@
+import copy
 import difflib
 import math
 import re
+import sys
+from abc import ABC, abstractmethod
+from collections import deque
 from fractions import Fraction
-from functools import reduce
-from typing import Any, Callable, Iterator, Optional
+from typing import (
+    Any,
+    Callable,
+    Container,
+    Generator,
+    Iterator,
+    Mapping,
+    MutableMapping,
+    Optional,
+)
 
 from mapping import recipe_sets_to_outputs
 
 
+def multiply_amount(amount: int | Fraction, factor: int | Fraction) -> int | Fraction:
+    """
+    Exact product of two amounts using integer arithmetic.
+    Fraction is created only when the product is not a whole number,
+    otherwise the product is an int.
+
+    Example: 1/10, 40 -> 4
+    Example: 1/100, 16 -> 4/25
+    """
+
+    numerator = amount.numerator * factor.numerator
+    denominator = amount.denominator * factor.denominator
+    if denominator == 1:
+        return numerator
+    if numerator % denominator == 0:
+        return numerator // denominator
+    return Fraction(numerator, denominator)
+
+
+def find_cycles(
+    names: list[str], edges: Callable[[str], list[str]], done: Container[str]
+) -> Iterator[list[str]]:
+    """
+    Yields the resources which reach each other through the edges, also
+    single resources, after every cycle they reach is yielded.
+    Resources which are done are not searched, so a cycle must be marked
+    done before the next one is yielded.
+
+    Example: a -> b, b -> a, b -> c -> [c], [a, b]
+    """
+
+    # Tarjan's algorithm finds the cycles with an explicit stack.
+    index: dict[str, int] = dict()
+    lowlink: dict[str, int] = dict()
+    component: list[str] = []
+    stack: list[tuple[str, Iterator[str]]] = []
+
+    def visit(name: str) -> None:
+        index[name] = lowlink[name] = len(index)
+        component.append(name)
+        stack.append((name, iter(edges(name))))
+
+    for name in names:
+        if name in done or name in index:
+            continue
+
+        visit(name)
+        while stack:
+            current, dependencies = stack[-1]
+            for dependency in dependencies:
+                if dependency in done:
+                    continue
+                if dependency not in index:
+                    visit(dependency)
+                    break
+
+                # Dependency is in the cycle which is still being searched.
+                lowlink[current] = min(lowlink[current], index[dependency])
+            else:
+                stack.pop()
+                if stack:
+                    parent = stack[-1][0]
+                    lowlink[parent] = min(lowlink[parent], lowlink[current])
+
+                if lowlink[current] == index[current]:
+                    start = component.index(current)
+                    yield component[start:]
+                    del component[start:]
+
+
 class Resource:
     """
     Resource class has only properties and no setters.
@@ -15,23 +97,38 @@ class Resource:
     Do not make factory methods, use the constructor!
     """
 
+    # Slots and interned names keep a large number of resources compact.
+    __slots__ = ("__amount", "__name")
+
+    # def __new__(cls, resource: Resource | tuple[Fraction, str] | str | Any):
+    def __new__(cls, resource):
+        # Resource is immutable so the copy can be the resource itself.
+        if isinstance(resource, Resource):
+            return resource
+        return super().__new__(cls)
+
     # def __init__(self, resource: tuple[Fraction, str] | tuple[int, str] | str | Any):
     def __init__(self, resource):
 
-        self.__amount: Fraction = Fraction(0)
-        self.__name: str = ""
+        self.__amount: Fraction
+        self.__name: str
 
         if isinstance(resource, Resource):
-            copy = Resource.__clone(resource)
-            self.__amount = copy.amount
-            self.__name = copy.name
+            return  # Copy constructor returned the same instance.
         elif isinstance(resource, tuple):
-            self.__amount, self.__name = resource
+            amount, name = resource
         elif isinstance(resource, str):
-            self.__amount, self.__name = Resource.__parse(resource)
+            amount, name = Resource.__parse(resource)
         else:
             raise TypeError(type(resource))
 
+        self.__amount = amount
+        self.__name = sys.intern(name)
+
+    def __getnewargs__(self) -> tuple[tuple[Fraction, str]]:
+        # Copies and pickles pass the argument which __new__ requires.
+        return ((self.__amount, self.__name),)
+
     @property
     def amount(self) -> Fraction:
         return self.__amount
@@ -46,6 +143,9 @@ class Resource:
             result = self.amount == other.amount and self.name == other.name
         return result
 
+    def __hash__(self) -> int:
+        return hash((self.amount, self.name))
+
     def __str__(self) -> str:
         return f"{self.amount} {self.name}"
 
@@ -57,58 +157,59 @@ class Resource:
         amount, name = resource.split(" ")
         return Fraction(amount), name
 
-    @classmethod
-    def __clone(cls, resource: "Resource") -> "Resource":
-        return cls((resource.amount, resource.name))
-
     def format_resource(self, margin: int) -> str:
         amount: int = int(self.amount)
         return f"{amount:{margin}d} {self.name}"
 
 
 class Equation:
+    """
+    Equation is a read-only sequence of resources.
+    Resources are immutable so they are shared rather than copied.
+    """
+
     # def __init__(self, resources: list[Resource] | list[str] | str | Any) -> None:
     def __init__(self, resources) -> None:
-        self.__resources: list[Resource] = []
+        self.__resources: tuple[Resource, ...] = ()
 
         # def make_resource(item: Resource | str) -> Resource:
         def make_resource(item) -> Resource:
             if isinstance(item, Resource):
-                return Resource(item)  # Copy constructor.
+                return item  # Resource is immutable.
             elif isinstance(item, str):
                 return Resource(item)
             else:
                 raise TypeError(type(item))
 
         # def make_resources(items: Equation | list[Resource] | list[str] | str):
-        def make_resources(items):
+        def make_resources(items) -> tuple[Resource, ...]:
             if isinstance(items, Equation):
-                return Equation.__clone(items).resources  # Copy constructor.
-            if isinstance(items, list):
-                return [make_resource(item) for item in resources]
+                return items.resources  # Equation is immutable.
+            if isinstance(items, (list, tuple)):
+                return tuple(make_resource(item) for item in items)
             elif isinstance(items, str):
-                return Equation.__parse(items)
+                return tuple(Equation.__parse(items))
             else:
                 raise TypeError(type(items))
 
         self.__resources = make_resources(resources)
 
     @property
-    def resources(self) -> list[Resource]:
-        # Resources are immutable thanks to the copy constructor.
-        return list(map(lambda x: Resource(x), self.__resources))
+    def resources(self) -> tuple[Resource, ...]:
+        # Resources are immutable and so is the tuple.
+        return self.__resources
 
     def __eq__(self, other: object) -> bool:
         result = False
         if isinstance(other, Equation):
-            if len(self.resources) == len(other.resources):
-                zipped = zip(self.resources, other.resources)
-                mapped = map(lambda pair: pair[0] == pair[1], zipped)
-                return reduce(lambda acc, cur: acc and cur, mapped, True)
+            result = self.__resources == other.resources
         return result
 
+    def __hash__(self) -> int:
+        return hash(self.__resources)
+
     def __iter__(self) -> Iterator[Resource]:
-        return iter(self.resources)
+        return iter(self.__resources)
 
     def __str__(self) -> str:
         """
@@ -117,9 +218,9 @@ class Equation:
         """
 
         output = ""
-        if self.resources:
+        if self.__resources:
             # Create an iterator to avoid accessing an index.
-            iterator = iter(self.resources)
+            iterator = iter(self.__resources)
 
             # Print the first element as is.
             output = str(next(iterator))
@@ -136,7 +237,7 @@ class Equation:
         return str(self)
 
     def filter(self, resource: Resource) -> "Equation":
-        resources = [r for r in self.resources if r != resource]
+        resources = [r for r in self.__resources if r != resource]
         return Equation(resources)
 
     @classmethod
@@ -163,52 +264,83 @@ class Equation:
 
         return resources
 
-    @classmethod
-    def __clone(cls, equation: "Equation") -> "Equation":
-        return cls([Resource((r.amount, r.name)) for r in equation])
-
     def multiply(self, fraction: Fraction) -> "Equation":
-        resources = [Resource((fraction * r.amount, r.name)) for r in self.resources]
+        resources = [
+            Resource((multiply_amount(r.amount, fraction), r.name))
+            for r in self.__resources
+        ]
         return Equation(resources)
 
     def evaluate(self) -> "Equation":
-        variables: dict[str, Resource] = dict()
+        """
+        Amounts are summed up as integer numerators over a common denominator.
+        Result is the same as rounding up a sum of fractions.
+        """
 
-        for resource in Equation(self):
-            if resource.name not in variables.keys():
-                variables[resource.name] = resource
-            else:
-                # Resource is immutable.
-                amount = variables[resource.name].amount + resource.amount
-                variables[resource.name] = Resource((amount, resource.name))
+        variables: dict[str, tuple[int, int]] = dict()
+
+        for resource in self.__resources:
+            amount = resource.amount
+            numerator, denominator = amount.numerator, amount.denominator
+
+            if resource.name in variables:
+                total, common = variables[resource.name]
+                if common == denominator:
+                    numerator += total
+                else:
+                    # Least common multiple keeps the numbers small.
+                    multiple = common // math.gcd(common, denominator) * denominator
+                    numerator *= multiple // denominator
+                    numerator += total * (multiple // common)
+                    denominator = multiple
+
+            variables[resource.name] = numerator, denominator
 
-        for name, resource in variables.items():
-            amount = math.ceil(resource.amount)  # type: ignore
-            variables[name] = Resource((amount, resource.name))
+        resources = []
+        for name, (numerator, denominator) in variables.items():
+            rounded = -(-numerator // denominator)  # Round up.
+            resources.append(Resource((rounded, name)))
 
-        resources = [variables[name] for name in variables.keys()]
         return Equation(resources)
 
+    def canonical(self) -> "Equation":
+        """
+        Amounts of the same name are summed up exactly and sorted by the name.
+        Resources which cancel out are left out, unless nothing else remains.
+        Equations with the same canonical form have the same result.
+        Use str of the canonical form as a stable key between processes.
+
+        Example: 1 fabricator + 2 anvil_bench + 1 fabricator -> 2 anvil_bench + 2 fabricator
+        Example: 1 fabricator - 1 fabricator -> 0 fabricator
+        """
+
+        amounts: dict[str, Fraction] = dict()
+        for resource in self.__resources:
+            amounts[resource.name] = amounts.get(resource.name, 0) + resource.amount
+
+        resources = [Resource((amounts[name], name)) for name in sorted(amounts)]
+        nonzero = [r for r in resources if r.amount != 0]
+        return Equation(nonzero or resources[:1])
+
     def sort_resources(self) -> "Equation":
         """Sort resources by the amount and then by the name."""
-        resources = self.resources
-        resources = sorted(resources, key=lambda x: x.name, reverse=False)
+        resources = sorted(self.__resources, key=lambda x: x.name, reverse=False)
         resources = sorted(resources, key=lambda x: x.amount, reverse=True)
         return Equation(resources)
 
     def format_resources(self) -> list[str]:
         """Returns a sorted list of resources as a formated strings."""
-        if self.resources == []:
+        if not self.__resources:
             return []
 
-        margin = max([len(str(r.amount)) for r in self.resources])
+        margin = max([len(str(r.amount)) for r in self.__resources])
         return [r.format_resource(margin) for r in self.sort_resources()]
 
     def suodata(self, all: bool = True, round: bool = True) -> "Equation":
         """Example: -1 stone + 1 wood - 12 wood = 0 stone + 1 wood + 0 wood"""
 
         new_resources: list[Resource] = []
-        for resource in self.resources:
+        for resource in self.__resources:
             new_resource = resource
             if resource.amount < 0 and round:
                 new_resource = Resource((0, resource.name))
@@ -220,13 +352,15 @@ class Equation:
 
     def get_quantity(self, name: str) -> Fraction:
         copy = self.evaluate()
-        for resource in copy.resources:
+        for resource in copy:
             if resource.name == name:
                 return resource.amount
         return Fraction(0)
 
 
 class EquationTree:
+    __slots__ = ("children", "data", "station")
+
     def __init__(self, data: Optional[Resource] = None, station=None) -> None:
         self.children: list[EquationTree] = []
         self.data: Optional[Resource] = data
@@ -234,43 +368,637 @@ class EquationTree:
 
     def __iter__(self) -> Iterator[Equation]:
         """Helper function for unit tests"""
-        if self.data:
-            yield Equation([self.data])
-        for tree_data in self.children:
-            yield from tree_data
+        stack: list[EquationTree] = [self]
+        while stack:
+            tree_data = stack.pop()
+            if tree_data.data:
+                yield Equation([tree_data.data])
+            stack += reversed(tree_data.children)
 
     def __str__(self) -> str:
         return str(self.data)
 
 
+class BillOfMaterials:
+    """
+    Fully expanded crafting cost of a resource.
+    Materials are raw materials and stations group the intermediate steps.
+    Amounts are exact because nothing is rounded between the steps.
+    """
+
+    def __init__(self) -> None:
+        self.materials: dict[str, int | Fraction] = dict()
+        self.stations: dict[str, dict[str, int | Fraction]] = dict()
+
+        # Multiples of the denominator are whole items along every path down
+        # the tech tree, so no step of calculate is rounded up for them.
+        # Zero denominator means cyclic recipes which are never linear.
+        self.denominator: int = 1
+
+    def add(self, other: "BillOfMaterials", amount: Fraction) -> None:
+        """Adds an amount of other bill of materials into this one."""
+
+        for name, value in other.materials.items():
+            product = multiply_amount(value, amount)
+            self.materials[name] = self.materials.get(name, 0) + product
+
+        for station, resources in other.stations.items():
+            intermediates = self.stations.setdefault(station, dict())
+            for name, value in resources.items():
+                product = multiply_amount(value, amount)
+                intermediates[name] = intermediates.get(name, 0) + product
+
+        # Sums are not enough, because partial amounts are rounded up
+        # whenever they are substituted or evaluated at separate steps.
+        if self.denominator and other.denominator:
+            ratio = Fraction(amount) / other.denominator
+            self.denominator = math.lcm(self.denominator, ratio.denominator)
+        else:
+            self.denominator = 0
+
+
+class Layer(MutableMapping[str, Any]):
+    """
+    Dictionary which keeps its changes apart from a shared dictionary.
+    Like the parents of a ChainMap, the shared dictionary is never written to.
+    Unlike a ChainMap, keys of the shared dictionary can be removed too.
+    Keys are in the same order as in a copy of the shared dictionary.
+    """
+
+    def __init__(self, shared: Mapping[str, Any]) -> None:
+        self.shared = shared
+        self.changes: dict[str, Any] = dict()
+        self.removed: set[str] = set()
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.changes:
+            return self.changes[key]
+        if key in self.removed:
+            raise KeyError(key)
+        return self.shared[key]
+
+    def __contains__(self, key: object) -> bool:
+        if key in self.changes:
+            return True
+        return key not in self.removed and key in self.shared
+
+    def get(self, key: str, default: Any = None) -> Any:
+        # Lookups are the common case and skip raising a KeyError.
+        if key in self.changes:
+            return self.changes[key]
+        if key in self.removed:
+            return default
+        return self.shared.get(key, default)
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self.changes[key] = value
+
+    def __delitem__(self, key: str) -> None:
+        if key not in self:
+            raise KeyError(key)
+        self.changes.pop(key, None)
+        if key in self.shared:
+            self.removed.add(key)
+
+    def pop(self, key: str, *default: Any) -> Any:
+        # Generic pop would look the key up several times.
+        if key in self.changes:
+            value = self.changes.pop(key)
+        elif key not in self.removed and key in self.shared:
+            value = self.shared[key]
+        elif default:
+            return default[0]
+        else:
+            raise KeyError(key)
+
+        if key in self.shared:
+            self.removed.add(key)
+        return value
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.shared:
+            if key not in self.removed:
+                yield key
+
+        # Removed key which is assigned again is moved to the end.
+        for key in self.changes:
+            if key not in self.shared or key in self.removed:
+                yield key
+
+    def __len__(self) -> int:
+        added = [k for k in self.changes if k not in self.shared or k in self.removed]
+        return len(self.shared) - len(self.removed) + len(added)
+
+
+class RecipeGraph:
+    """
+    Dependency graph compiled from the recipes of a calculator.
+    Resource depends on its ingredients and on the station it is crafted at.
+    """
+
+    # Compiled tables which can be saved and restored as they are.
+    tables = (
+        "ingredients",
+        "workstations",
+        "requirements",
+        "workstation_sets",
+        "station_values",
+        "consumers",
+        "products",
+    )
+
+    def __init__(self, calculator: "Calculator") -> None:
+        # Tables are dictionaries or layers over the tables of a shared graph.
+        self.ingredients: MutableMapping[str, list[str]] = dict()
+        self.workstations: MutableMapping[str, list[str]] = dict()
+        self.requirements: MutableMapping[str, frozenset[str]] = dict()
+
+        # Workstations to be crafted for a resource and all its ingredients.
+        self.workstation_sets: MutableMapping[str, frozenset[str]] = dict()
+
+        # Tiers of crafting stations are used to order crafting steps.
+        self.station_values: MutableMapping[str, int] = dict()
+
+        # Reverse index answers which recipes consume a resource.
+        self.consumers: MutableMapping[str, list[str]] = dict()
+        self.products: MutableMapping[str, list[str]] = dict()
+
+        # Resources of added recipes are compiled again when needed.
+        self.outdated: bool = False
+
+        # Recipes are read-only and bills of materials are memoized.
+        self.recipes: MutableMapping[str, Equation] = dict(calculator.resources)
+        self.stations: MutableMapping[str, str] = dict(calculator.stations)
+        self.bills: MutableMapping[str, BillOfMaterials] = dict()
+
+        for name, equation in calculator.resources.items():
+            # Remove duplicates before storing.
+            ingredients = [r.name for r in equation]
+            self.ingredients[name] = list(dict.fromkeys(ingredients))
+
+            # Variable is required elsewhere as a workbench.
+            station = calculator.stations[name]
+            workstations = [station, recipe_sets_to_outputs(station)]
+            self.workstations[name] = list(dict.fromkeys(workstations))
+
+            for ingredient in self.ingredients[name]:
+                self.consumers.setdefault(ingredient, []).append(name)
+            for station in self.workstations[name]:
+                self.products.setdefault(station, []).append(name)
+
+        for name in self.ingredients:
+            self.compile(name)
+
+        for station in self.stations.values():
+            self.get_station_value(station)
+
+    @classmethod
+    def from_tables(
+        cls, calculator: "Calculator", tables: Mapping[str, Any]
+    ) -> "RecipeGraph":
+        """
+        Returns a graph of a calculator with the tables compiled before,
+        like the tables of a snapshot, rather than compiling them again.
+        Other fields are initialized as in a new graph.
+        """
+
+        graph = cls(Calculator())
+        graph.recipes = dict(calculator.resources)
+        graph.stations = dict(calculator.stations)
+        for table in cls.tables:
+            setattr(graph, table, tables[table])
+        return graph
+
+    def overlay(self) -> "RecipeGraph":
+        """
+        Returns a graph which keeps its changes apart from this graph.
+        Nothing is copied, so this graph may still be shared by other threads.
+        """
+
+        graph = copy.copy(self)
+        graph.ingredients = Layer(self.ingredients)
+        graph.workstations = Layer(self.workstations)
+        graph.requirements = Layer(self.requirements)
+        graph.workstation_sets = Layer(self.workstation_sets)
+        graph.station_values = Layer(self.station_values)
+        graph.consumers = Layer(self.consumers)
+        graph.products = Layer(self.products)
+        graph.recipes = Layer(self.recipes)
+        graph.stations = Layer(self.stations)
+        graph.bills = Layer(self.bills)
+        return graph
+
+    def add_recipe(self, name: str, equation: Equation, station: str) -> None:
+        """
+        Adds a recipe of a resource which had none, like a resolved option.
+        Only the resource and the resources which depend on it as an ingredient
+        or as a station are compiled again by update.
+        """
+
+        self.recipes[name] = equation
+        self.stations[name] = station
+
+        # Remove duplicates before storing.
+        ingredients = [r.name for r in equation]
+        self.ingredients[name] = list(dict.fromkeys(ingredients))
+        workstations = [station, recipe_sets_to_outputs(station)]
+        self.workstations[name] = list(dict.fromkeys(workstations))
+
+        # Lists may belong to a shared graph, so they are replaced.
+        for ingredient in self.ingredients[name]:
+            self.consumers[ingredient] = self.consumers.get(ingredient, []) + [name]
+        for workstation in self.workstations[name]:
+            self.products[workstation] = self.products.get(workstation, []) + [name]
+
+        # Users of a resource which is already outdated are outdated too.
+        outdated: list[str] = [name]
+        for current in outdated:
+            self.requirements.pop(current, None)
+            self.workstation_sets.pop(current, None)
+            self.station_values.pop(current, None)
+            self.bills.pop(current, None)
+
+            users = self.consumers.get(current, []) + self.products.get(current, [])
+            outdated += [u for u in dict.fromkeys(users) if u in self.requirements]
+
+        self.outdated = True
+
+    def update(self) -> None:
+        """Compiles the resources which are outdated by added recipes."""
+
+        if not self.outdated:
+            return
+
+        # Cyclic recipes are compiled in the same order as in a new graph.
+        for name in self.ingredients:
+            if name not in self.requirements:
+                self.compile(name)
+        self.outdated = False
+
+    def compile(self, name: str) -> None:
+        """
+        Precompute transitive requirements and workstations of a resource.
+        Requirements of a workstation are not requirements of the resource.
+        """
+
+        self.close(
+            [name],
+            self.requirements,
+            lambda name: self.ingredients.get(name, []),
+            lambda name: [name] + self.workstations.get(name, []),
+        )
+
+        # Workstation has to be crafted along with its own workstations.
+        def get_stations(name: str) -> list[str]:
+            workstation = self.get_workstation(name)
+            return [workstation] if workstation else []
+
+        self.close(
+            [name],
+            self.workstation_sets,
+            lambda name: self.ingredients.get(name, []) + get_stations(name),
+            get_stations,
+        )
+
+    def close(
+        self,
+        names: list[str],
+        table: MutableMapping[str, frozenset[str]],
+        edges: Callable[[str], list[str]],
+        labels: Callable[[str], list[str]],
+    ) -> None:
+        """
+        Stores the labels of every resource reachable from each resource.
+        Resources which reach each other share one set, so the set does not
+        depend on the resource from which the search entered their cycle.
+        """
+
+        for members in find_cycles(names, edges, table):
+            closure: set[str] = set()
+            for member in members:
+                closure.update(labels(member))
+                for dependency in edges(member):
+                    closure |= table.get(dependency, frozenset())
+            for member in members:
+                table[member] = frozenset(closure)
+
+    def requires(self, name: str, variable: str) -> bool:
+        """
+        Resource requires a variable if it occures anywhere below in the tech tree.
+        Resources in a cycle of recipes require each other but not themselves.
+
+        Example: hunting_rifle, iron_ore -> True
+        Example: hunting_rifle, iron_ingot -> False
+        """
+
+        # Most resources are unrelated, which is found with a single lookup.
+        requirements = self.requirements.get(name)
+        if requirements is None or variable not in requirements:
+            return False
+        return name != variable
+
+    def get_workstation(self, name: str) -> Optional[str]:
+        """
+        Returns the craftable workstation of a resource if there is one.
+
+        Example: anvil_bench -> crafting_bench
+        Example: crafting_bench -> None
+        """
+
+        if name not in self.stations:
+            return None
+        return self.get_station_item(self.stations[name])
+
+    def get_station_item(self, station: str) -> Optional[str]:
+        """
+        Returns the craftable resource of a station if there is one.
+
+        Example: crafting_bench -> crafting_bench
+        Example: character -> None
+        """
+
+        if station not in self.recipes:
+            # Recipes will be read directly from the game file.
+            # There's no need to support any other mapping function.
+            station = recipe_sets_to_outputs(station)
+        if station in self.recipes:
+            return station
+        return None
+
+    def get_crafting_order(self, names: list[str]) -> list[str]:
+        """
+        Returns the order in which find_resources yields craftable resources
+        when every resource has a positive amount. Only names are substituted.
+        Resources required by a present resource are counted rather than
+        searched on every round.
+
+        Example: anvil_bench -> anvil_bench, iron_ingot
+        """
+
+        order: list[str] = []
+        present: list[str] = []
+        blockers: dict[str, int] = dict()
+
+        def enter(names: list[str]) -> None:
+            # Present resources which require a resource block it.
+            for name in names:
+                if name in blockers:
+                    continue
+                blockers[name] = 0
+                for other in present:
+                    blockers[name] += self.requires(other, name)
+                    blockers[other] += self.requires(name, other)
+                present.append(name)
+
+        enter([name for name in dict.fromkeys(names) if name in self.recipes])
+        while present:
+            # Resources which no other resource requires.
+            candidates = [name for name in present if blockers[name] == 0]
+
+            if candidates:
+                # Pick a station of currently highest tier.
+                station = max(
+                    (self.stations[name] for name in candidates),
+                    key=lambda station: (self.get_station_value(station), station),
+                )
+                chosen = [n for n in candidates if self.stations[n] == station]
+            else:
+                # Resources which require each other are substituted together.
+                chosen = list(present)
+            order += chosen
+
+            # Substitute recipes and keep the first occurence of every name.
+            crafted = set(chosen)
+            substituted: list[str] = []
+            for name in present:
+                if name in crafted:
+                    substituted += self.ingredients[name]
+                else:
+                    substituted.append(name)
+
+            # Crafted resource may return, if it is in a cycle of recipes.
+            present = [name for name in present if name not in crafted]
+            for name in chosen:
+                del blockers[name]
+                for other in present:
+                    blockers[other] -= self.requires(name, other)
+
+            remaining = [n for n in dict.fromkeys(substituted) if n in self.recipes]
+            enter(remaining)
+            present = remaining
+
+        return order
+
+    def get_users(
+        self,
+        variable: str,
+        consumers: Optional[Mapping[str, list[str]]] = None,
+        products: Optional[Mapping[str, list[str]]] = None,
+    ) -> list[str]:
+        """
+        Returns every recipe which requires a variable in the order of recipes.
+        Consumers and products of recipes outside the graph, like options,
+        are followed too and come after the recipes of the graph.
+
+        Example: iron_ingot -> anvil_bench, iron_nail, ..., machining_bench, ...
+        """
+
+        consumers = consumers or dict()
+        products = products or dict()
+
+        def get_consumers(name: str) -> list[str]:
+            return self.consumers.get(name, []) + consumers.get(name, [])
+
+        # Requirements of a workstation are not requirements of the resource,
+        # so only the recipes crafted at the variable are followed as stations.
+        users: list[str] = get_consumers(variable)
+        users += self.products.get(variable, []) + products.get(variable, [])
+        users = list(dict.fromkeys(users))
+        visited: set[str] = set(users)
+        queue: deque[str] = deque(users)
+        while queue:
+            for user in get_consumers(queue.popleft()):
+                if user not in visited:
+                    visited.add(user)
+                    users.append(user)
+                    queue.append(user)
+
+        # Resources in a cycle of recipes do not require themselves.
+        visited.discard(variable)
+        ordered = [name for name in self.ingredients if name in visited]
+        others = visited.difference(ordered)
+        return ordered + [name for name in users if name in others]
+
+    def get_station_value(self, station: str) -> int:
+        """
+        Returns a memoized tier of a crafting station.
+        Station crafted at another station is one tier above it.
+
+        Example: character_crafting -> 1
+        Example: fabricator -> 4
+        """
+
+        # Walk down until a known or a root station is found.
+        chain: list[str] = []
+        while station not in self.station_values and station in self.stations:
+            chain.append(station)
+            station = self.stations[station]
+
+        value = self.station_values.setdefault(station, 1)
+        for station in reversed(chain):
+            value += 1
+            self.station_values[station] = value
+        return value
+
+    def get_bill(self, name: str) -> BillOfMaterials:
+        """
+        Returns a memoized bill of materials for one unit of a resource.
+
+        Example: crafting_bench -> 60 fiber + 50 wood + 12 stone + 20 leather
+        Example: iron_ore -> 1 iron_ore
+        """
+
+        if name in self.bills:
+            return self.bills[name]
+
+        # Graph may be shared, so only complete bills are published.
+        bills: dict[str, BillOfMaterials] = dict()
+
+        def get(name: str) -> Optional[BillOfMaterials]:
+            return bills.get(name) or self.bills.get(name)
+
+        stack: list[str] = [name]
+        done: set[str] = set()
+        while stack:
+            current = stack[-1]
+
+            # Ingredients are added up before the resource itself.
+            if get(current) is None:
+                # Cyclic recipes would otherwise never terminate.
+                bills[current] = BillOfMaterials()
+                if current in self.recipes:
+                    ingredients = [r.name for r in self.recipes[current]]
+                    stack += [i for i in reversed(ingredients) if get(i) is None]
+                continue
+
+            stack.pop()
+            if current in done or current not in bills:
+                continue
+            done.add(current)
+
+            bill = bills[current]
+
+            # Raw materials are not expanded any further.
+            if current not in self.recipes:
+                bill.materials[current] = Fraction(1)
+                continue
+
+            bill.stations[self.stations[current]] = {current: Fraction(1)}
+            for resource in self.recipes[current]:
+                bill.add(
+                    bills.get(resource.name) or self.bills[resource.name],
+                    resource.amount,
+                )
+                if resource.name in bills and resource.name not in done:
+                    # Ingredient is still being added up, so it is incomplete.
+                    bill.denominator = 0
+
+        self.bills.update(bills)
+        return self.bills[name]
+
+
 class Calculator:
     def __init__(self):
         # Validator depends on the file being read.
         self.validator: Validator = Validator(self)
 
-        self.resources: dict[str, Equation] = dict()
-        self.resources_str: dict[str, str] = dict()
-        self.options: dict[str, list[str]] = dict()
-        self.variables: list[str] = list()
-        self.stations: dict[str, str] = dict()
+        self.resources: MutableMapping[str, Equation] = dict()
+        self.resources_str: MutableMapping[str, str] = dict()
+        self.options: MutableMapping[str, list[str]] = dict()
+        # Unassigned variables are an ordered set of names.
+        self.variables: MutableMapping[str, None] = dict()
+        self.stations: MutableMapping[str, str] = dict()
         self.errors: list[str] = list()
 
-    def assign_equation(self, assignment: str) -> None:
-        # Validate an assignment before processing any further.
-        self.validator.validate_syntax_assignment(assignment)
+        # Dependency graph is compiled once the recipes are needed.
+        self.graph: Optional[RecipeGraph] = None
 
-        # Every craftable resource should have a crafting station.
-        station, assignment_tail = assignment.split(" : ")
+        # Graph which options are compared on is layered rather than changed.
+        self.kept: Optional[RecipeGraph] = None
+
+        # Reverse index of unresolved options is parsed once it is needed.
+        self.option_index: Optional[
+            tuple[dict[str, list[str]], dict[str, list[str]]]
+        ] = None
+
+        # Chosen options of every policy by the first option.
+        self.choices: dict[str, dict[str, int]] = dict()
 
-        # Separate an assignment into a Resource and an Equation.
-        left, right = assignment_tail.split(" = ")
+        # Recipes are shared with another calculator until they change.
+        self.shared: bool = False
 
-        resource = Resource(left)
-        equation = Equation(right)
+        # Version is increased whenever the recipes change.
+        self.version: int = 0
+
+    def overlay(self) -> "Calculator":
+        """
+        Returns a calculator which shares the recipes of this calculator.
+        Changes are layered over the shared recipes on the first write,
+        so resolving options of the overlay never changes this calculator.
+        """
+
+        # Dependency graph is compiled once and shared by every overlay.
+        self.get_graph()
+
+        calculator = Calculator()
+        calculator.resources = self.resources
+        calculator.resources_str = self.resources_str
+        calculator.options = self.options
+        calculator.variables = self.variables
+        calculator.stations = self.stations
+        calculator.errors = self.errors
+        calculator.graph = self.graph
+        calculator.shared = True
+        calculator.version = self.version
+
+        # Choices depend on the options resolved by the overlay.
+        calculator.choices = {k: dict(v) for k, v in self.choices.items()}
+
+        return calculator
+
+    def unshare(self) -> None:
+        """Layers the shared recipes and graph before they are changed."""
+
+        if not self.shared:
+            return
+
+        self.resources = Layer(self.resources)
+        self.resources_str = Layer(self.resources_str)
+        self.options = Layer(self.options)
+        self.variables = Layer(self.variables)
+        self.stations = Layer(self.stations)
+        self.errors = list(self.errors)
+        if self.graph is not None:
+            self.graph = self.graph.overlay()
+        self.shared = False
+
+    def assign_equation(self, assignment: str) -> None:
+        # Validate an assignment while separating it into a Resource and an Equation.
+        # Every craftable resource should have a crafting station.
+        station, resource, equation = self.validator.parse_assignment(assignment)
         equation = equation.multiply(Fraction(1, resource.amount))
 
         name = resource.name
 
+        # Recipes of an overlay are copied before the first change.
+        self.unshare()
+
+        # Recipes changed so the dependency graph must be compiled again.
+        self.graph = None
+        self.option_index = None
+        self.choices = dict()
+        self.version += 1
+
         # Variable name can be assigned just once.
         if name in self.resources:
             if name not in self.options:
@@ -286,43 +1014,83 @@ class Calculator:
                 self.stations[name] = station
                 self.resources_str[name] = assignment
             elif name in self.options:
-                self.options[name].append(assignment)
+                # List may be shared with another calculator.
+                self.options[name] = self.options[name] + [assignment]
 
         # Resource will be removed from the variables list when it's assigned.
-        self.variables = [var for var in self.variables if var != resource.name]
+        self.variables.pop(name, None)
 
         # Add new variables into the unassigned variables list.
         for resource in equation.resources:
             if resource.name not in self.resources:
                 if resource.name not in self.options:
-                    if resource.name not in self.variables:
-                        self.variables.append(resource.name)
+                    self.variables.setdefault(resource.name)
+
+    def get_graph(self) -> RecipeGraph:
+        if self.graph is None:
+            self.graph = RecipeGraph(self)
+        self.graph.update()
+        return self.graph
+
+    def keep_graph(self) -> RecipeGraph:
+        """
+        Returns the current graph and keeps it for comparing options.
+        Options resolved later are added to an overlay of the kept graph.
+        """
+
+        self.kept = self.get_graph()
+        return self.kept
 
     def get_keywords(self) -> list[str]:
         keywords = list(self.resources.keys())
         keywords += self.options.keys()
-        keywords += self.variables.copy()
+        keywords += self.variables.keys()
 
         # Remove duplicates keywords.
         return list(dict.fromkeys(keywords))
 
     def resolve_recipes(self, equation: Equation, callback: Callable) -> None:
-        stack: list[Resource] = equation.resources[:]
-        while stack != []:
-            resource: Resource = stack.pop(0)
-            if resource.name in self.options.keys():
-                options = self.options[resource.name]
+        """
+        Ask the user which recipe to use.
+        Resources are visited breadth first and only once.
+        """
 
+        names: list[str] = [r.name for r in equation]
+        visited: set[str] = set(names)
+        queue: deque[str] = deque(names)
+        while queue:
+            name: str = queue.popleft()
+            if name in self.options:
                 # Return control to application to ask user.
                 # Application does not need to know details.
-                choice: int = callback(options)
+                choice: int = callback(self.options[name])
+                self.resolve_option(name, choice)
+            if name in self.resources:
+                for resource in self.resources[name]:
+                    if resource.name not in visited:
+                        visited.add(resource.name)
+                        queue.append(resource.name)
+
+    def resolve_option(self, name: str, choice: int) -> None:
+        """
+        Assigns the chosen recipe of a resource.
+        Recipe is added to the compiled graph rather than compiled again.
+        Kept graph is layered, so it still has the recipes it had.
+        """
 
-                line = self.options[resource.name][choice]
-                del self.options[resource.name]
-                self.assign_equation(line)
-            if resource.name in self.resources:
-                next_equation: Equation = self.resources[resource.name]
-                stack += next_equation.resources.copy()
+        self.unshare()
+        line = self.options.pop(name)[choice]
+
+        # Other options are still chosen the same way.
+        choices, graph = self.choices, self.graph
+        self.assign_equation(line)
+        self.choices = choices
+
+        if graph is not None:
+            if graph is self.kept:
+                graph = graph.overlay()
+            graph.add_recipe(name, self.resources[name], self.stations[name])
+            self.graph = graph
 
     def calculate(self, equation: Equation) -> Iterator[Equation]:
         """
@@ -344,6 +1112,80 @@ class Calculator:
 
         return equation
 
+    def calculate_total(self, equation: Equation) -> Equation:
+        """
+        Returns the raw materials of the last step of calculate.
+        Memoized bills of materials for one unit are scaled and summed up
+        when no intermediate step would be rounded up, because calculate is
+        linear then. Otherwise the recipes are substituted step by step.
+
+        Example: 10 stick + 1 anvil_bench -> 21 wood + 80 iron_ore + 10 stone
+        """
+
+        equation = equation.evaluate()
+        graph = self.get_graph()
+
+        bills = [(graph.get_bill(r.name), r.amount) for r in equation]
+        for bill, amount in bills:
+            if amount <= 0 or not bill.denominator or amount % bill.denominator:
+                return deque(self.calculate(equation), maxlen=1).pop()
+
+        # Intermediate steps are not needed for the raw materials.
+        materials: dict[str, int | Fraction] = dict()
+        for bill, amount in bills:
+            for name, value in bill.materials.items():
+                product = multiply_amount(value, amount)
+                materials[name] = materials.get(name, 0) + product
+
+        resources = [Resource((v, k)) for k, v in materials.items()]
+        return Equation(resources)
+
+    def get_option_index(self) -> tuple[dict[str, list[str]], dict[str, list[str]]]:
+        """
+        Returns the recipes of unresolved options which consume a resource
+        as an ingredient or as a station. Every option is counted.
+
+        Example: leather -> ({"leather": ["rope", ...]}, {...})
+        """
+
+        if self.option_index is None:
+            # Index is published only when it is complete.
+            consumers: dict[str, list[str]] = dict()
+            products: dict[str, list[str]] = dict()
+            for name, options in self.options.items():
+                ingredients: list[str] = []
+                workstations: list[str] = []
+                for option in options:
+                    station, _, equation = self.validator.parse_assignment(option)
+                    ingredients += [r.name for r in equation]
+                    workstations += [station, recipe_sets_to_outputs(station)]
+
+                # Remove duplicates before storing.
+                for ingredient in dict.fromkeys(ingredients):
+                    consumers.setdefault(ingredient, []).append(name)
+                for workstation in dict.fromkeys(workstations):
+                    products.setdefault(workstation, []).append(name)
+            self.option_index = (consumers, products)
+
+        return self.option_index
+
+    def where_used(self, name: str) -> dict[str, list[str]]:
+        """
+        Returns recipes which consume a resource as an ingredient or as a station
+        and every recipe further up in the tech tree which requires it.
+        Resources with unresolved options are consumers through any option.
+
+        Example: crafting_bench -> {"ingredient": [], "station": ["rope", ...], "required": [...]}
+        """
+
+        graph = self.get_graph()
+        consumers, products = self.get_option_index()
+        return {
+            "ingredient": graph.consumers.get(name, []) + consumers.get(name, []),
+            "station": graph.products.get(name, []) + products.get(name, []),
+            "required": graph.get_users(name, consumers, products),
+        }
+
     def suodata(self, equation: Equation) -> Equation:
         """
         Returns equation with only highest tier resources in it.
@@ -354,15 +1196,17 @@ class Calculator:
         Example: 1 anvil_bench + 1 machining_bench + 1 cement_mixer + 1 concrete_furnace + 1 fabricator -> 1 fabricator
         """
 
+        graph = self.get_graph()
+
+        # Recipes are not dependent on non-craftable recipes.
+        positive = [r.name for r in equation if r.amount > 0]
+
         new_resources = []
         for resource in equation:
-            temp = Equation([r for r in equation if r.name != resource.name])
-            # Recipes are not dependent on non-craftable recipes.
-            temp = Equation([r for r in temp if r.amount > 0])
-            found: list[str] = self.search_variable(resource.name, temp)
-            if found == [] and resource.name in self.resources:
-                # Reduce positive resources only.
-                if resource.amount > 0:
+            # Reduce positive resources only.
+            if resource.amount > 0 and resource.name in self.resources:
+                required = [graph.requires(name, resource.name) for name in positive]
+                if not any(required):
                     new_resources.append(resource)
 
         # All resources are raw materials.
@@ -412,16 +1256,40 @@ class Calculator:
                 if variable in (station, mapped):
                     variables.append(part.name)
 
-            # Recursive function call for a derivative expression.
+            # Search derivative expressions for the variable.
             if part.name in self.resources.keys():
                 expression = self.resources[part.name]
-                found = self.search_variable(variable, expression, True)
-                if found != []:
+                if self.search_expression(variable, expression):
                     variables.append(part.name)
 
         # Remove duplicates before returning.
         return list(dict.fromkeys(variables))
 
+    def search_expression(self, variable: str, expression: Equation) -> bool:
+        """
+        Variable occures in a derivative expression as a resource or as a workbench.
+        """
+
+        stack: list[Resource] = list(expression.resources)
+        visited: set[str] = set()
+        while stack:
+            part = stack.pop()
+            if part.name == variable:
+                return True
+
+            # Variable is required elsewhere as a workbench.
+            if part.name in self.stations:
+                station = self.stations[part.name]
+                mapped = recipe_sets_to_outputs(station)
+                if variable in (station, mapped):
+                    return True
+
+            if part.name in self.resources and part.name not in visited:
+                visited.add(part.name)
+                stack += self.resources[part.name].resources
+
+        return False
+
     def find_similar(self, equation: Equation) -> dict[str, list[str]]:
         assert isinstance(equation, Equation)
 
@@ -443,11 +1311,13 @@ class Calculator:
         Example: 1 biofuel_extractor + 1 biofuel_generator = fabricator
         """
 
+        graph = self.get_graph()
+
         max_station = self.stations[resources[0].name]
-        max_value = self.get_station_value(max_station)
+        max_value = graph.get_station_value(max_station)
         for i in range(1, len(resources)):
             station = self.stations[resources[i].name]
-            value = self.get_station_value(station)
+            value = graph.get_station_value(station)
             if max_value < value or (max_value == value and max_station < station):
                 max_value = value
                 max_station = station
@@ -455,11 +1325,7 @@ class Calculator:
         return max_station
 
     def get_station_value(self, station: str) -> int:
-        value = 1
-        while station in self.stations:
-            station = self.stations[station]
-            value += 1
-        return value
+        return self.get_graph().get_station_value(station)
 
     def resources_per_station(self, equation: Equation) -> Equation:
         """
@@ -479,7 +1345,7 @@ class Calculator:
                 # Calculate the amounts of new resources.
                 for new_resource in new_equation:
                     # Resource is immutable.
-                    amount = new_resource.amount * resource.amount
+                    amount = multiply_amount(new_resource.amount, resource.amount)
                     new_resource = Resource((amount, new_resource.name))
                     crafting_cost.append(new_resource)
 
@@ -500,7 +1366,7 @@ class Calculator:
         """
 
         # There should be at least one resource to be crafted.
-        if equation.resources == []:
+        if not equation.resources:
             raise AssertionError("Equation was empty.")
 
         # Convert items
@@ -523,6 +1389,7 @@ class Calculator:
         Equation tree represents the process of crafting items.
         Equation may have non-positive values but they will be ignored.
         Non-positive values make no sense when visualizing a crafting process.
+        Identical subtrees are the same nodes, so the tree must not be modified.
         """
 
         equation = self.arrange_resources(equation)
@@ -530,12 +1397,17 @@ class Calculator:
         nonpositive = Equation([r for r in equation if r.amount < 0])
         equation = Equation([r for r in equation if r.amount > 0])
 
+        # Identical subtrees are shared rather than built again.
+        # Equation tree is then a directed acyclic graph of nodes.
+        subtrees: dict[tuple, tuple[EquationTree, Equation]] = dict()
+
         def create_equation_tree(
             root: EquationTree, equation: Equation, nonpositive: Equation
-        ) -> tuple[EquationTree, Equation]:
+        ) -> Generator[tuple[EquationTree, Equation, Equation], Equation, Equation]:
+            """Yields subtrees to be created and receives what remains of nonpositive."""
 
             # Resources are read-only.
-            resources = equation.resources
+            resources = list(equation.resources)
             resources += nonpositive
 
             # Equation is immutable.
@@ -546,35 +1418,101 @@ class Calculator:
             equation = Equation([r for r in equation if r.amount > 0])
 
             for resource in equation:
-                # Wrap into tree data structure.
-                node = EquationTree(resource)
+                # Subtree depends on the remaining non-positive values too.
+                key: tuple = (resource.name, resource.amount)
+                key += tuple((r.name, r.amount) for r in nonpositive)
+
+                if key not in subtrees:
+                    # Wrap into tree data structure.
+                    node = EquationTree(resource)
+
+                    # Where resource should be crafted at.
+                    if resource.name in self.stations:
+                        node.station = self.stations[resource.name]
+
+                    # Repeat for the remaining recipes.
+                    remaining = nonpositive
+                    if resource.name in self.resources:
+                        nodes = Equation([resource])
+                        nodes = self.korvaa(nodes, nodes)
+                        remaining = yield node, nodes, nonpositive
+
+                    subtrees[key] = node, remaining
 
                 # Skip non-positive values.
+                node, nonpositive = subtrees[key]
                 root.children.append(node)
 
-                # Where resource should be crafted at.
-                if resource.name in self.stations:
-                    node.station = self.stations[resource.name]
+            return nonpositive
 
-                # Repeat for the remaining recipes.
-                if resource.name in self.resources:
-                    nodes = Equation([resource])
-                    nodes = self.korvaa(nodes, nodes)
-                    _, nonpositive = create_equation_tree(node, nodes, nonpositive)
+        root = EquationTree()
 
-            return root, nonpositive
+        stack = [create_equation_tree(root, equation, nonpositive)]
+        remaining: Optional[Equation] = None
+        while stack:
+            try:
+                # First value sent to a new generator is always None.
+                subtree = stack[-1].send(remaining)  # type: ignore
+            except StopIteration as stop:
+                stack.pop()
+                remaining = stop.value
+            else:
+                stack.append(create_equation_tree(*subtree))
+                remaining = None
 
-        root = EquationTree()
-        root, nonpositive = create_equation_tree(root, equation, nonpositive)
         return root
 
     def arrange_resources(self, equation: Equation) -> Equation:
+        """
+        Returns resources in the order they should be crafted in.
+        Resources at the highest tier station which no other resource requires
+        are taken first, like suodata would, and the order is reversed at the end.
+
+        Example: 1 machining_bench + 1 stone_furnace + 1 anvil_bench -> 1 stone_furnace + 1 anvil_bench + 1 machining_bench
+        """
+
+        graph = self.get_graph()
+        resources = list(equation.resources)
+        remaining = list(range(len(resources)))
+
+        # Positive resources block the resources they require.
+        blocks: list[list[int]] = [[] for _ in resources]
+        blockers = [0] * len(resources)
+        for i in remaining:
+            if resources[i].amount > 0:
+                for j in remaining:
+                    if graph.requires(resources[i].name, resources[j].name):
+                        blocks[i].append(j)
+                        blockers[j] += 1
+
         new_resources: list[Resource] = []
-        while equation.resources:
-            resources = self.suodata(equation).resources
-            resources = sorted(resources, key=lambda r: r.amount, reverse=True)
-            new_resources += resources
-            equation = Equation([r for r in equation if r not in resources])
+        while remaining:
+            candidates = []
+            for i in remaining:
+                resource = resources[i]
+                if resource.amount > 0 and resource.name in self.resources:
+                    if blockers[i] == 0:
+                        candidates.append(i)
+
+            # All resources are raw materials.
+            chosen = remaining
+            if candidates:
+                # Pick a station of currently highest tier.
+                station = self.order_by_station([resources[i] for i in candidates])
+                stations = [self.stations[resources[i].name] for i in candidates]
+                chosen = [i for i, s in zip(candidates, stations) if s == station]
+
+            chosen = sorted(chosen, key=lambda i: resources[i].amount, reverse=True)
+            new_resources += [resources[i] for i in chosen]
+
+            removed = set(chosen)
+            remaining = [i for i in remaining if i not in removed]
+
+            # Resources are no longer required by the removed resources.
+            for i in chosen:
+                for j in blocks[i]:
+                    blockers[j] -= 1
+
         return Equation(new_resources[::-1])
 
     def find_resources(self, equation: Equation) -> Iterator[str]:
@@ -599,7 +1537,46 @@ class Calculator:
         return equation
 
     def find_workstations(self, equation: Equation) -> Equation:
-        """List the required workstations."""
+        """
+        List the required workstations.
+        Workstations are a union over the precomputed table of every resource.
+        They are added in the order find_workstations_by_resources would add them.
+        """
+
+        equation = equation.evaluate()
+
+        # Non-positive resources may cancel out intermediate steps.
+        if any(r.amount <= 0 for r in equation):
+            return self.find_workstations_by_resources(equation)
+
+        graph = self.get_graph()
+        names = [r.name for r in equation]
+
+        required: set[str] = set()
+        for name in names:
+            required |= graph.workstation_sets.get(name, frozenset())
+        missing = required.difference(names)
+
+        while missing:
+            # Workstations are added in rounds like substitutions would find them.
+            stations = map(graph.get_workstation, graph.get_crafting_order(names))
+            workstations = [s for s in dict.fromkeys(stations) if s in missing]
+            if not workstations:
+                break
+
+            names += workstations
+            missing.difference_update(workstations)
+
+        # Resources are read-only.
+        resources = list(equation.resources)
+        resources += [Resource((1, name)) for name in names[len(resources) :]]
+
+        # Equation is immutable.
+        equation = Equation(resources)
+        return equation.evaluate()
+
+    def find_workstations_by_resources(self, equation: Equation) -> Equation:
+        """List the required workstations by substituting the recipes."""
 
         equation = equation.evaluate()
         stations: list[str] = []
@@ -624,14 +1601,14 @@ class Calculator:
 
         if workstations:
             # Resources are read-only.
-            resources = equation.resources
+            resources = list(equation.resources)
             resources += workstations
 
             # Equation is immutable.
             equation = Equation(resources)
             equation = equation.evaluate()
 
-            return self.find_workstations(equation)
+            return self.find_workstations_by_resources(equation)
         else:
             return equation
 
@@ -641,36 +1618,32 @@ class Calculator:
         Take into account all intermediate steps.
         """
 
-        memory: list[str] = []
         equation = equation.evaluate()
-        stack: list[str] = [r.name for r in equation]
-        while stack != []:
-            resource: str = stack.pop(0)
-            if resource in memory:
-                continue
+        names: list[str] = [r.name for r in equation]
 
-            memory.append(resource)
+        # Resources which have been queued at some point.
+        visited: set[str] = set(names)
+        queue: deque[str] = deque(names)
+        while queue:
+            resource: str = queue.popleft()
 
             if resource in self.options:
-                options = self.options[resource]
-
-                choice: int = callback(options)
-
-                line: str = options[choice]
-                del self.options[resource]
-                self.assign_equation(line)
+                choice: int = callback(self.options[resource])
+                self.resolve_option(resource, choice)
 
             if resource in self.stations:
                 station = self.stations[resource]
-                if station not in memory and station not in stack:
-                    stack.append(station)
+                if station not in visited:
+                    visited.add(station)
+                    queue.append(station)
 
             if resource in self.resources:
                 new_resources = self.resources[resource]
                 for new_resource in new_resources:
                     name = new_resource.name
-                    if name not in memory and name not in stack:
-                        stack.append(name)
+                    if name not in visited:
+                        visited.add(name)
+                        queue.append(name)
 
     def convert_to_dictionaries(self, equation: EquationTree):
         """
@@ -679,21 +1652,24 @@ class Calculator:
         Use this with json.dumps to stringify an equation tree.
         """
 
-        def traverse(equations: list[EquationTree]):
-            return list(
-                map(
-                    lambda root: {
-                        "name": root.data.name,  # type: ignore
-                        "amount": int(root.data.amount),  # type: ignore
-                        "count": 1,  # TODO
-                        "station": root.station,
-                        "children": traverse(root.children),  # type: ignore
-                    },
-                    equations,
-                )
+        output: list[dict[str, Any]] = []
+
+        stack = [(root, output) for root in reversed(equation.children)]
+        while stack:
+            root, siblings = stack.pop()
+            children: list[dict[str, Any]] = []
+            siblings.append(
+                {
+                    "name": root.data.name,  # type: ignore
+                    "amount": int(root.data.amount),  # type: ignore
+                    "count": 1,  # TODO
+                    "station": root.station,
+                    "children": children,
+                }
             )
+            stack += [(child, children) for child in reversed(root.children)]
 
-        return traverse(equation.children)
+        return output
 
 
 class Validator:
@@ -703,31 +1679,89 @@ class Validator:
     def __init__(self, calc: Calculator):
         self.calc = calc
 
-    def validate_syntax_assignment(self, assignment: str) -> None:
-        num = Validator.pattern_num
-        var = Validator.pattern_var
+    # Patterns are compiled once and shared by every validator.
+    regex_head = re.compile(f"({pattern_var}) : ({pattern_num}) ({pattern_var}) = ")
+    regex_first = re.compile(f"()({pattern_num}) ({pattern_var})(?= [+-] |\\Z)")
+    regex_signed = re.compile(f"(-?)({pattern_num}) ({pattern_var})(?= [+-] |\\Z)")
+    regex_term = re.compile(f" ([+-]) ({pattern_num}) ({pattern_var})(?= [+-] |\\Z)")
 
-        pattern = re.compile(f"{var} : {num} {var} = {num} {var}( [+-] {num} {var})*")
-        if not pattern.fullmatch(assignment):
-            raise SyntaxError("SyntaxError: " + assignment)
+    def validate_syntax_assignment(self, assignment: str) -> None:
+        self.parse_assignment(assignment)
 
     def validate_syntax_calculation(self, equation: str) -> None:
-        num = Validator.pattern_num
-        var = Validator.pattern_var
+        self.parse_calculation(equation)
+
+    def parse_assignment(self, assignment: str) -> tuple[str, Resource, Equation]:
+        """
+        Validates and parses an assignment in a single pass.
+
+        Example: crafting_bench : 1 rope = 12 fiber -> crafting_bench, 1 rope, 12 fiber
+        """
+
+        match = Validator.regex_head.match(assignment)
+        if not match:
+            raise Validator.syntax_error(assignment, 0)
 
-        pattern = re.compile(f"[-]?{num} {var}( [+-] {num} {var})*")
-        if not pattern.fullmatch(equation):
-            raise SyntaxError("SyntaxError: " + equation)
+        resources = Validator.scan(assignment, match.end(), Validator.regex_first)
+        station, amount, name = match.groups()
+        resource = Resource((Validator.to_amount(amount), name))
+        return station, resource, Equation(resources)
+
+    def parse_calculation(self, equation: str) -> Equation:
+        """
+        Validates and parses an equation in a single pass.
+        Only the first amount may be negative without an operator.
+
+        Example: -1 stone + 1 wood -> -1 stone + 1 wood
+        """
+
+        return Equation(Validator.scan(equation, 0, Validator.regex_signed))
+
+    @classmethod
+    def scan(cls, text: str, position: int, pattern: re.Pattern) -> list[Resource]:
+        """
+        Reads terms until the end of text or raises a SyntaxError.
+        Syntax of the whole text is checked before any amount is converted.
+        """
+
+        terms: list[tuple[str, ...]] = []
+        while match := pattern.match(text, position):
+            terms.append(match.groups())
+            position = match.end()
+            pattern = Validator.regex_term
+
+        if position != len(text) or not terms:
+            raise Validator.syntax_error(text, position)
+
+        resources: list[Resource] = []
+        for sign, amount, name in terms:
+            value = Validator.to_amount(amount)
+            resources.append(Resource((-value if sign == "-" else value, name)))
+        return resources
+
+    @classmethod
+    def to_amount(cls, amount: str) -> Fraction:
+        # Whole numbers are the common case and skip parsing a string.
+        if amount.isdecimal():
+            return Fraction(int(amount))
+        return Fraction(amount)
+
+    @classmethod
+    def syntax_error(cls, text: str, position: int) -> SyntaxError:
+        """Error message is kept short and the position is an attribute."""
+
+        error = SyntaxError("SyntaxError: " + text)
+        error.text = text
+        error.offset = position + 1
+        return error
 
     def validate_value_calculation(self, equation: Equation) -> None:
         errors: list[str] = []
         for resource in equation:
 
             # Resource should be mentioned in tech tree.
-            if resource.name not in self.calc.resources:
-                if resource.name not in self.calc.options:
-                    if resource.name not in self.calc.variables:
-                        errors.append(resource.name)
+            if not self.is_known(resource.name):
+                errors.append(resource.name)
 
             # Attempt to create raw materials is pointless.
             if resource.name in self.calc.variables and resource.amount >= 0:
@@ -736,3 +1770,288 @@ class Validator:
         if errors != []:
             error: str = ", ".join(errors)
             raise ValueError("ValueError: " + error)
+
+    def validate_value_names(self, equation: Equation) -> None:
+        errors: list[str] = []
+        for resource in equation:
+
+            # Resource should be mentioned in tech tree.
+            if not self.is_known(resource.name):
+                errors.append(resource.name)
+
+        if errors != []:
+            error: str = ", ".join(errors)
+            raise ValueError("ValueError: " + error)
+
+    def is_known(self, name: str) -> bool:
+        if name not in self.calc.resources:
+            if name not in self.calc.options:
+                if name not in self.calc.variables:
+                    return False
+        return True
+
+
+class RecipeOptimizer:
+    """
+    Chooses the recipe options which minimize the total weighted cost.
+    Cost of a resource is the cost of its cheapest recipe for one unit,
+    so options further down in the tech tree are taken into account too.
+    Raw materials weigh one unless a weight is given.
+    Costs are memoized once every resource they depend on is resolved.
+    """
+
+    def __init__(self, calc: Calculator, weights: Optional[dict[str, Fraction]] = None):
+        self.calc = calc
+        self.weights: dict[str, Fraction] = dict(weights or {})
+
+        # Cheapest cost and recipe of every resource evaluated so far.
+        self.costs: dict[str, Fraction] = dict()
+        self.choices: dict[str, int] = dict()
+
+        # Options are parsed once when they are needed.
+        self.options: dict[str, list[Equation]] = dict()
+
+    def get_recipes(self, name: str) -> list[Equation]:
+        """
+        Returns the ingredients of every recipe of a resource for one unit.
+
+        Example: wood_floor -> [4 wood, 4 wood, 4 wood]
+        Example: wood -> []
+        """
+
+        if name in self.calc.resources:
+            return [self.calc.resources[name]]
+        if name not in self.calc.options:
+            return []
+        if name not in self.options:
+            recipes: list[Equation] = []
+            for option in self.calc.options[name]:
+                _, resource, equation = self.calc.validator.parse_assignment(option)
+                recipes.append(equation.multiply(Fraction(1, resource.amount)))
+            self.options[name] = recipes
+        return self.options[name]
+
+    def get_ingredients(self, name: str) -> list[str]:
+        """
+        Returns the ingredients of every recipe of a resource.
+
+        Example: wood_floor -> [wood]
+        """
+
+        names = [r.name for recipe in self.get_recipes(name) for r in recipe]
+        return list(dict.fromkeys(names))
+
+    def get_cost(self, name: str) -> Fraction:
+        """
+        Returns the weighted cost of one unit of a resource.
+        Resources which need each other are resolved together once every
+        resource they need is known, so the cost does not depend on the
+        resource from which the search entered their cycle.
+
+        Example: crafting_bench -> 142
+        """
+
+        if name in self.costs:
+            return self.costs[name]
+
+        for names in find_cycles([name], self.get_ingredients, self.costs):
+            self.resolve(names)
+
+        return self.costs[name]
+
+    def resolve(self, names: list[str]) -> None:
+        """
+        Memoizes the costs of resources which may need each other.
+        Cheapest resource is resolved first like in Dijkstra's algorithm,
+        so a chosen recipe never needs a resource which is not resolved yet.
+        """
+
+        pending = sorted(names)
+        while pending:
+            costs = [self.evaluate(name) for name in pending]
+            i = min(range(len(pending)), key=lambda i: costs[i][0])
+
+            name = pending.pop(i)
+            self.costs[name], choice = costs[i]
+            if self.get_recipes(name):
+                self.choices[name] = choice
+
+    def evaluate(self, name: str) -> tuple[Any, int]:
+        """
+        Returns the cost and the index of the cheapest recipe.
+        Ingredients which are not resolved cost infinitely much.
+        """
+
+        recipes = self.get_recipes(name)
+        if not recipes:
+            return self.weights.get(name, Fraction(1)), 0
+
+        costs: list[Any] = []
+        for recipe in recipes:
+            cost: Any = Fraction(0)
+            for resource in recipe:
+                value = self.costs.get(resource.name, math.inf)
+                cost += value * resource.amount
+            costs.append(cost)
+
+        choice = costs.index(min(costs))
+        return costs[choice], choice
+
+    def choose(self, name: str) -> int:
+        """Returns the index of the cheapest option of a resource."""
+
+        self.get_cost(name)
+        return self.choices.get(name, 0)
+
+
+class Policy(ABC):
+    """
+    Chooses a recipe among the options without asking an user.
+    Policy is a callback function to resolve_recipes.
+    Choices are made once per policy and kept until the recipes change.
+    Options are compared on the recipes as they were when the policy was
+    first used, so resolving options never compiles the graph again.
+    Policy writes its choices to its calculator.
+    """
+
+    def __init__(self, calc: Calculator):
+        self.calc = calc
+        self.graph: Optional[RecipeGraph] = None
+
+    @property
+    def key(self) -> str:
+        return type(self).__name__
+
+    def get_graph(self) -> RecipeGraph:
+        if self.graph is None:
+            self.graph = self.calc.keep_graph()
+        return self.graph
+
+    def __call__(self, options: list[str]) -> int:
+        choices = self.calc.choices.setdefault(self.key, dict())
+        if options[0] not in choices:
+            choices[options[0]] = self.choose(options)
+        return choices[options[0]]
+
+    @abstractmethod
+    def choose(self, options: list[str]) -> int:
+        pass
+
+    def parse_option(self, option: str) -> tuple[str, Equation]:
+        """
+        Returns the station and the ingredients of a single resource.
+
+        Example: crafting_bench : 10 rope = 120 fiber -> crafting_bench, 12 fiber
+        """
+
+        station, resource, equation = self.calc.validator.parse_assignment(option)
+        return station, equation.multiply(Fraction(1, resource.amount))
+
+
+class FirstPolicy(Policy):
+    def choose(self, options: list[str]) -> int:
+        """Recipe which was read first."""
+        return 0
+
+
+class CheapestPolicy(Policy):
+    def choose(self, options: list[str]) -> int:
+        """
+        Recipe with the least raw materials in total.
+        Unresolved options are counted as raw materials.
+        """
+
+        graph = self.get_graph()
+        costs: list[Fraction] = []
+        for option in options:
+            _, equation = self.parse_option(option)
+            total = BillOfMaterials()
+            for resource in equation:
+                total.add(graph.get_bill(resource.name), resource.amount)
+            amounts = [v for v in total.materials.values() if v > 0]
+            costs.append(Fraction(sum(amounts)))
+        return costs.index(min(costs))
+
+
+class StationPolicy(Policy):
+    def choose(self, options: list[str]) -> int:
+        """
+        Recipe with the fewest workstations to be crafted.
+        Station of the recipe counts even if it cannot be crafted.
+        """
+
+        graph = self.get_graph()
+        counts: list[int] = []
+        for option in options:
+            station, equation = self.parse_option(option)
+            stations: set[str] = {station}
+            if workstation := graph.get_station_item(station):
+                stations = {workstation} | graph.workstation_sets[workstation]
+            for resource in equation:
+                stations |= graph.workstation_sets.get(resource.name, frozenset())
+            counts.append(len(stations))
+        return counts.index(min(counts))
+
+
+class OptimalPolicy(Policy):
+    """
+    Recipes which minimize the weighted cost of the whole plan.
+    Unlike CheapestPolicy, options of the ingredients are taken into account.
+
+    Example: {"iron_ore": 2}
+    """
+
+    def __init__(self, calc: Calculator, weights: Optional[dict[str, Fraction]] = None):
+        super().__init__(calc)
+        self.optimizer = RecipeOptimizer(calc, weights)
+
+    @property
+    def key(self) -> str:
+        weights = ",".join(
+            f"{k}={v}" for k, v in sorted(self.optimizer.weights.items())
+        )
+        return f"{type(self).__name__}:{weights}"
+
+    def choose(self, options: list[str]) -> int:
+        _, resource, _ = self.calc.validator.parse_assignment(options[0])
+        return self.optimizer.choose(resource.name)
+
+
+class ExplicitPolicy(Policy):
+    """
+    Recipes are chosen by the user in advance.
+    Other options are left to a fallback policy.
+
+    Example: {"concrete_mix": "1"}
+    """
+
+    def __init__(self, calc: Calculator, choices: dict[str, str], fallback: Policy):
+        super().__init__(calc)
+        self.choices = choices
+        self.fallback = fallback
+
+        # Invalid choices would only split the cached outputs.
+        for name, choice in choices.items():
+            options = calc.options.get(name, [])
+            if not (choice.isdigit() and int(choice) < len(options)):
+                raise ValueError(f"ValueError: {name}={choice}")
+
+    @property
+    def key(self) -> str:
+        choices = ",".join(f"{k}={v}" for k, v in sorted(self.choices.items()))
+        return f"{self.fallback.key}:{choices}"
+
+    def choose(self, options: list[str]) -> int:
+        _, resource, _ = self.calc.validator.parse_assignment(options[0])
+        if resource.name not in self.choices:
+            return self.fallback.choose(options)
+        return int(self.choices[resource.name])
+
+
+# Policies which can be named by a web request.
+policies: dict[str, type[Policy]] = {
+    "first": FirstPolicy,
+    "cheapest": CheapestPolicy,
+    "stations": StationPolicy,
+    "optimal": OptimalPolicy,
+}
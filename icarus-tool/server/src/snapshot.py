@@ -0,0 +1,105 @@
+import json
+import marshal
+import sys
+from fractions import Fraction
+from typing import Any, Optional
+
+from cache import hash_files
+from calculator import Calculator, Equation, RecipeGraph, Resource
+
+# Increase whenever the layout or the compiled tables of the snapshot change.
+VERSION = 3
+
+
+def snapshot_filename(files: list[str]) -> str:
+    """Example: data/tech_tree.txt -> data/tech_tree.txt.snapshot"""
+    return files[0] + ".snapshot"
+
+
+def snapshot_header(files: list[str]) -> dict[str, Any]:
+    """Snapshot is valid for the same layout and contents of the same files."""
+
+    return {
+        "version": VERSION,
+        "marshal": marshal.version,
+        "files": list(files),
+        "hash": hash_files(files),
+    }
+
+
+def encode_equation(equation: Equation) -> list[tuple[int, int, str]]:
+    """Example: 1/2 wood -> [(1, 2, "wood")]"""
+    return [(r.amount.numerator, r.amount.denominator, r.name) for r in equation]
+
+
+def decode_equation(resources: list[tuple[int, int, str]]) -> Equation:
+    """Example: [(1, 2, "wood")] -> 1/2 wood"""
+    return Equation([Resource((Fraction(n, d), name)) for n, d, name in resources])
+
+
+def save_snapshot(calculator: Calculator, files: list[str]) -> str:
+    """
+    Writes recipes and the compiled dependency graph of a calculator into a
+    binary file. Snapshot is valid as long as the files read do not change.
+    Only plain data is written, so loading a snapshot never runs any code.
+    """
+
+    graph = calculator.get_graph()
+
+    body = {
+        "resources": {k: encode_equation(v) for k, v in calculator.resources.items()},
+        "resources_str": dict(calculator.resources_str),
+        "options": {k: list(v) for k, v in calculator.options.items()},
+        "variables": list(calculator.variables),
+        "stations": dict(calculator.stations),
+        "errors": list(calculator.errors),
+        **{table: dict(getattr(graph, table)) for table in RecipeGraph.tables},
+    }
+
+    # Header is a readable line which is checked before the body is decoded.
+    filename = snapshot_filename(files)
+    with open(filename, "wb") as file:
+        file.write(json.dumps(snapshot_header(files)).encode() + b"\n")
+        marshal.dump(body, file)
+    return filename
+
+
+def load_snapshot(files: list[str]) -> Optional[Calculator]:
+    """
+    Returns a calculator of a snapshot which was saved from the same files.
+    Missing, outdated or broken snapshot is not an error but returns None,
+    so the files are read instead.
+    """
+
+    try:
+        with open(snapshot_filename(files), "rb") as file:
+            if json.loads(file.readline()) != snapshot_header(files):
+                return None
+            # Reading at once is faster than letting marshal read the file.
+            body = marshal.loads(file.read())
+
+        calculator = Calculator()
+        resources = body["resources"]
+        calculator.resources = {k: decode_equation(v) for k, v in resources.items()}
+        calculator.resources_str = body["resources_str"]
+        calculator.options = body["options"]
+        calculator.variables = dict.fromkeys(body["variables"])
+        calculator.stations = body["stations"]
+        calculator.errors = body["errors"]
+
+        # Graph is restored as it was compiled rather than compiled again.
+        calculator.graph = RecipeGraph.from_tables(calculator, body)
+    except (OSError, ValueError, EOFError, KeyError, TypeError):
+        return None
+
+    return calculator
+
+
+if __name__ == "__main__":
+    # Compile the files given as arguments into a snapshot.
+    from application import Application
+
+    application = Application()
+    application.init(sys.argv)
+    if application.files:
+        print(save_snapshot(application.calculator, application.files))
@@ -0,0 +1,138 @@
+import graphlib
+import math
+from collections import deque
+from fractions import Fraction
+
+from calculator import Calculator, Equation, Resource
+
+try:
+    import numpy  # type: ignore[import]
+except ImportError:
+    numpy = None  # type: ignore[assignment]
+
+
+class MatrixSolver:
+    """
+    Optional engine to calculate raw materials with NumPy.
+    Every recipe is a sparse row of ingredients needed to craft one unit,
+    so only the coordinates of the ingredients are stored.
+    Demand is propagated from the recipes down to the raw materials,
+    one batch of recipes which do not need each other at a time.
+    Iterative algorithm remains the reference for the crafting process.
+    """
+
+    # Floating point errors are smaller than this.
+    tolerance = 1e-6
+
+    def __init__(self, calculator: Calculator):
+        if numpy is None:
+            raise ImportError("No module named 'numpy'")
+
+        self.calculator = calculator
+        self.version = calculator.version
+
+        # Recipe is crafted before the ingredients it consumes.
+        consumers: dict[str, list[str]] = dict()
+        for name, equation in calculator.resources.items():
+            consumers.setdefault(name, [])
+            for resource in equation:
+                consumers.setdefault(resource.name, []).append(name)
+
+        sorter = graphlib.TopologicalSorter(consumers)
+        try:
+            sorter.prepare()
+        except graphlib.CycleError as err:
+            raise ValueError("ValueError: " + ", ".join(err.args[1][1:])) from err
+
+        batches: list[tuple[str, ...]] = []
+        while sorter.is_active():
+            batch = sorter.get_ready()
+            sorter.done(*batch)
+            batches.append(batch)
+
+        self.names: list[str] = [name for batch in batches for name in batch]
+        self.index: dict[str, int] = {name: i for i, name in enumerate(self.names)}
+
+        # Coordinates and coefficients of the recipes of every batch.
+        self.batches = []
+        for batch in batches:
+            rows: list[int] = []
+            columns: list[int] = []
+            values: list[float] = []
+            for name in batch:
+                for resource in calculator.resources.get(name, []):
+                    rows.append(self.index[name])
+                    columns.append(self.index[resource.name])
+                    values.append(float(resource.amount))
+            if rows:
+                self.batches.append(
+                    (numpy.array(rows), numpy.array(columns), numpy.array(values))
+                )
+
+        names = self.names
+        recipes = [i for i, name in enumerate(names) if name in calculator.resources]
+        raw = [i for i, name in enumerate(names) if name not in calculator.resources]
+        self.rows = numpy.array(recipes, dtype=int)
+        self.raw = numpy.array(raw, dtype=int)
+
+    def propagate(self, demand):
+        """Returns total demand of every resource for each row of demand."""
+
+        total = demand.copy()
+        for rows, columns, values in self.batches:
+            # Recipes of a batch may share ingredients, so columns repeat.
+            numpy.add.at(total.T, columns, (total[:, rows] * values).T)
+        return total
+
+    def calculate(self, equation: Equation) -> Equation:
+        """
+        Returns raw materials to be gathered for an equation.
+        Amounts are rounded up only once after all the steps.
+        Non-positive amounts may cancel out intermediate steps,
+        so those equations are calculated by the iterative algorithm.
+
+        Example: 1 crafting_bench + 1 anvil_bench -> 60 fiber + 70 wood + 22 stone + 20 leather + 80 iron_ore
+        """
+
+        equation = equation.evaluate()
+        if any(r.amount <= 0 for r in equation):
+            total = deque(self.calculator.calculate(equation), maxlen=1).pop()
+            return Equation([r for r in total if r.amount > 0])
+
+        demand = numpy.zeros((1, len(self.names)))
+        extra: dict[str, Fraction] = dict()
+        for resource in equation:
+            if resource.name in self.index:
+                demand[0, self.index[resource.name]] += float(resource.amount)
+            else:
+                # Resource is not mentioned in any recipe.
+                extra[resource.name] = extra.get(resource.name, 0) + resource.amount
+
+        total = self.propagate(demand)[0]
+        resources = self.to_resources(total)
+        resources += [Resource((math.ceil(v), k)) for k, v in extra.items()]
+        return Equation([r for r in resources if r.amount > 0])
+
+    def calculate_all(self) -> dict[str, Equation]:
+        """Returns raw materials for one unit of every recipe at once."""
+
+        demand = numpy.zeros((len(self.rows), len(self.names)))
+        demand[numpy.arange(len(self.rows)), self.rows] = 1
+        total = self.propagate(demand)
+
+        output: dict[str, Equation] = dict()
+        for i, row in enumerate(self.rows):
+            output[self.names[row]] = Equation(self.to_resources(total[i]))
+        return output
+
+    def to_resources(self, total) -> list[Resource]:
+        resources: list[Resource] = []
+        for i in self.raw:
+            value = total[i]
+            rounded = round(value)
+            if abs(value - rounded) < MatrixSolver.tolerance:
+                value = rounded
+            amount = math.ceil(value)
+            if amount != 0:
+                resources.append(Resource((amount, self.names[i])))
+        return resources
@@ -0,0 +1,113 @@
+"""
+Benchmark of recipe resolution on the full tech tree.
+Former traversals are kept here as a reference, they popped the front of a
+list and searched lists, so shared ingredients were expanded again and again.
+
+Usage: PYTHONPATH=src python test/benchmark_resolve.py [repeat]
+"""
+
+import sys
+import time
+from typing import Callable
+
+from application import FileSystem, JsonSystem
+from calculator import Calculator, Equation, Resource
+
+
+def former_resolve_recipes(
+    calculator: Calculator, equation: Equation, callback: Callable
+) -> None:
+    stack: list[Resource] = list(equation.resources)
+    while stack != []:
+        resource: Resource = stack.pop(0)
+        if resource.name in calculator.options:
+            choice: int = callback(calculator.options[resource.name])
+            calculator.resolve_option(resource.name, choice)
+        if resource.name in calculator.resources:
+            stack += calculator.resources[resource.name].resources
+
+
+def former_resolve_recipes_implicit(
+    calculator: Calculator, equation: Equation, callback: Callable
+) -> None:
+    memory: list[str] = []
+    equation = equation.evaluate()
+    stack: list[str] = [r.name for r in equation]
+    while stack != []:
+        resource: str = stack.pop(0)
+        if resource in memory:
+            continue
+
+        memory.append(resource)
+
+        if resource in calculator.options:
+            choice: int = callback(calculator.options[resource])
+            calculator.resolve_option(resource, choice)
+
+        if resource in calculator.stations:
+            station = calculator.stations[resource]
+            if station not in memory and station not in stack:
+                stack.append(station)
+
+        if resource in calculator.resources:
+            for new_resource in calculator.resources[resource]:
+                name = new_resource.name
+                if name not in memory and name not in stack:
+                    stack.append(name)
+
+
+def diamond(levels: int) -> Calculator:
+    """Every item needs two items which both need the same item: 2^levels paths."""
+
+    calculator = Calculator()
+    for i in range(levels):
+        calculator.assign_equation(f"character : 1 item_{i} = 1 left_{i} + 1 right_{i}")
+        calculator.assign_equation(f"character : 1 left_{i} = 1 item_{i + 1}")
+        calculator.assign_equation(f"character : 1 right_{i} = 1 item_{i + 1}")
+    calculator.assign_equation(f"character : 1 item_{levels} = 1 wood")
+    return calculator
+
+
+def measure(calculator: Calculator, resolve: Callable, repeat: int) -> float:
+    """Returns the best time in milliseconds of resolving every recipe at once."""
+
+    names = list(dict.fromkeys([*calculator.resources, *calculator.options]))
+    equation = Equation([Resource((1, name)) for name in names])
+
+    best = float("inf")
+    for _ in range(repeat):
+        # Options are removed once resolved, so every run gets an overlay.
+        overlay = calculator.overlay()
+        start = time.perf_counter()
+        resolve(overlay, equation, lambda options: 0)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main(repeat: int) -> None:
+    calculators: dict[str, Calculator] = dict()
+    FileSystem("data/tech_tree.txt").read(
+        calculators.setdefault("tech_tree.txt", Calculator())
+    )
+    JsonSystem("data/crafting/D_ProcessorRecipes.json").read(
+        calculators.setdefault("D_ProcessorRecipes.json", Calculator())
+    )
+    calculators["diamond (12 levels)"] = diamond(12)
+
+    pairs = {
+        "resolve_recipes": (former_resolve_recipes, Calculator.resolve_recipes),
+        "resolve_recipes_implicit": (
+            former_resolve_recipes_implicit,
+            Calculator.resolve_recipes_implicit,
+        ),
+    }
+    for filename, calculator in calculators.items():
+        print(filename)
+        for method, (former, current) in pairs.items():
+            before = measure(calculator, former, repeat)
+            after = measure(calculator, current, repeat)
+            print(f"  {method:<26}{before:9.2f} ms ->{after:8.2f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
@@ -1,9 +1,10 @@
 import json
 import unittest
+import unittest.mock
 
-from ddt import data, ddt
+from ddt import data, ddt, unpack
 
-from app import app
+from app import app, get_policy, results, tech_tree
 from application import Application
 
 
@@ -47,6 +48,136 @@ class TestApp(unittest.TestCase):
         # Output should not differ between CLI and Web application.
         self.assertEqual(expected, actual)
 
+    @data("first", "cheapest", "stations", "optimal")
+    def test_plaintext_policy(self, policy: str):
+        """Tech tree has no options so every policy gives the same output."""
+
+        with app.test_client() as client:
+            expected = client.get("/api/plaintext/1%20fabricator").data
+            actual = client.get(f"/api/plaintext/1%20fabricator?policy={policy}").data
+
+        self.assertEqual(expected, actual)
+
+    def test_tech_tree_loaded_once(self):
+        """Requests share the tech tree rather than read it again."""
+
+        resources = tech_tree.calculator.resources
+        with unittest.mock.patch("builtins.open", side_effect=AssertionError):
+            with app.test_client() as client:
+                response = client.get("/api/plaintext/1%20fabricator")
+
+        self.assertEqual(200, response.status_code)
+        self.assertNotIn("AssertionError", response.data.decode("utf-8"))
+        self.assertIs(resources, tech_tree.calculator.resources)
+
+    def test_results(self):
+        """Identical queries are rendered once."""
+
+        results.clear()
+        with app.test_client() as client:
+            expected = client.get("/api/json/2%20fabricator").data
+            before = client.get("/api/cache").get_json()
+            actual = client.get("/api/json/1%20fabricator%20+%201%20fabricator").data
+            after = client.get("/api/cache").get_json()
+
+        self.assertEqual(expected, actual)
+        self.assertEqual(before["hits"] + 1, after["hits"])
+        self.assertEqual(before["misses"], after["misses"])
+
+    @data(
+        ("1 wood_wall + 1 wood_floor", "1 wood_floor + 1 wood_wall"),
+        ("1 anvil_bench - 1 iron_ingot + 1 iron_ingot", "1 anvil_bench"),
+    )
+    @unpack
+    def test_results_canonical(self, first: str, second: str):
+        """Variants of a query give the same output, whichever is cached."""
+
+        outputs = []
+        with app.test_client() as client:
+            for query in [first, second]:
+                results.clear()
+                url = "/api/plaintext/" + query.replace(" ", "%20")
+                outputs.append(client.get(url).data)
+
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_plaintext_policy_shared(self):
+        """Policies of the requests never write to the shared recipes."""
+
+        results.clear()
+        calculator = tech_tree.calculator
+        graph = calculator.get_graph()
+        with unittest.mock.patch("app.get_policy", wraps=get_policy) as mock:
+            with app.test_client() as client:
+                for policy in ["cheapest", "stations", "optimal"]:
+                    client.get(f"/api/plaintext/1%20fabricator?policy={policy}")
+
+        self.assertEqual(3, mock.call_count)
+        for args in mock.call_args_list:
+            self.assertIsNot(calculator, args[0][0])
+        self.assertEqual({}, calculator.choices)
+        self.assertFalse(calculator.shared)
+        self.assertIs(graph, calculator.get_graph())
+
+    def test_plaintext_policy_error(self):
+        with app.test_client() as client:
+            url = "/api/plaintext/1%20fabricator?policy=nothing"
+            actual = client.get(url).data.decode("utf-8")
+
+        self.assertEqual("ValueError: policy=nothing", actual.split("\n")[0])
+
+    def test_get_policy_weights(self):
+        """Raw materials are weighed by the optimal policy only."""
+
+        args = {"policy": "optimal", "weights": "iron_ore:2,wood:1/2"}
+        policy = get_policy(tech_tree.calculator, args)
+        self.assertEqual("OptimalPolicy:iron_ore=2,wood=1/2", policy.key)
+
+        for args in [
+            {"policy": "cheapest", "weights": "iron_ore:2"},
+            {"policy": "optimal", "weights": "fabricator:2"},
+            {"policy": "optimal", "weights": "iron_ore:-2"},
+            {"policy": "optimal", "weights": "iron_ore"},
+        ]:
+            with self.assertRaises(ValueError):
+                get_policy(tech_tree.calculator, args)
+
+        with app.test_client() as client:
+            expected = client.get("/api/plaintext/1%20fabricator").data
+            url = "/api/plaintext/1%20fabricator?policy=optimal&weights=iron_ore:2"
+            actual = client.get(url).data
+
+        self.assertEqual(expected, actual)
+
+    def test_plaintext_option_error(self):
+        """Only items with options can be chosen by a parameter."""
+
+        with app.test_client() as client:
+            url = "/api/plaintext/1%20fabricator?fabricator=1"
+            actual = client.get(url).data.decode("utf-8")
+
+        self.assertEqual("ValueError: fabricator=1", actual.split("\n")[0])
+
+    def test_where_used(self):
+        application = Application()
+        application.init(["app.py", "data/tech_tree.txt"])
+        expected = application.calculator.where_used("yeast")
+
+        with app.test_client() as client:
+            actual = json.loads(client.get("/api/json/where-used/yeast").data)
+
+        self.assertEqual("yeast", actual.pop("name"))
+        self.assertEqual(expected, actual)
+        self.assertIn("bread_dough", actual["ingredient"])
+        self.assertIn("bread", actual["required"])
+
+    def test_where_used_not_found(self):
+        with app.test_client() as client:
+            response = client.get("/api/json/where-used/nothing")
+
+        self.assertEqual(404, response.status_code)
+        self.assertEqual({"error": "ValueError: nothing"}, response.get_json())
+
     def test_index(self):
         """Client build should exist on deployment server."""
 
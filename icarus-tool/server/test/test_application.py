@@ -1,12 +1,21 @@
+import io
 import json
+import sys
 import unittest
 import unittest.mock
 from typing import Any, Callable
 
 from ddt import data, ddt, file_data
 
-from application import Application, FileSystem, JsonSystem
-from calculator import Calculator
+from application import (
+    Application,
+    FileSystem,
+    Implicit,
+    JsonStream,
+    JsonSystem,
+    Recursive,
+)
+from calculator import Calculator, CheapestPolicy, Equation
 
 APPLICATION = "./application.py"
 
@@ -74,9 +83,42 @@ class JsonSystemTest(unittest.TestCase):
 
         self.assertEqual(388, resources := len(calculator.resources))
         self.assertEqual(9, errors := len(calculator.errors))
+        self.assertIn("Biofuel1: no Outputs", calculator.errors)
+        self.assertIn("Ore_Meta: no Inputs", calculator.errors)
         self.assertEqual(475, options)
         self.assertTrue(643 <= resources + errors + options)
 
+    def test_read_rows(self):
+        with open(JsonSystemTest.filename) as file:
+            rows = json.load(file)["Rows"]
+
+        reader = JsonSystem(JsonSystemTest.filename, ("Name", "RequiredMillijoules"))
+        expected = [
+            {key: row[key] for key in ("Name", "RequiredMillijoules") if key in row}
+            for row in rows
+        ]
+        self.assertEqual(expected, list(reader.read_rows()))
+
+    def test_stream(self):
+        with open(JsonSystemTest.filename) as file:
+            rows = json.load(file)["Rows"]
+
+        # Values are split between chunks.
+        with open(JsonSystemTest.filename) as file:
+            self.assertEqual(rows, list(JsonStream(file, chunk_size=7).rows("Rows")))
+
+    def test_stream_other_values(self):
+        text = '{"a": [1, {"b": "]"}], "Rows": [ 1 , [2], {"c": 3} ], "d": 12345}'
+        stream = JsonStream(io.StringIO(text), chunk_size=3)
+        self.assertEqual([1, [2], {"c": 3}], list(stream.rows("Rows")))
+
+        stream = JsonStream(io.StringIO('{"Rows": []}'))
+        self.assertEqual([], list(stream.rows("Rows")))
+
+        stream = JsonStream(io.StringIO('{"Rows": [1 2]}'))
+        with self.assertRaises(ValueError):
+            list(stream.rows("Rows"))
+
 
 @ddt
 class ApplicationTest(unittest.TestCase):
@@ -98,6 +140,9 @@ class ApplicationTest(unittest.TestCase):
             "  -g --gnu          Apply GNU readline functionality to python's input.",
             "  -i --implicit     Add all the necessary intermediate steps.",
             "  -r --recursive    Show the output as a tree data structure.",
+            "  -w --where-used   List the recipes which consume the resources.",
+            "  -m --matrix       Calculate the total resources at once with NumPy.",
+            "  -s --snapshot     Load the files from an up to date snapshot.",
             "  -h --help         Show this user manual and exit.",
         ]
 
@@ -130,6 +175,7 @@ class ApplicationTest(unittest.TestCase):
         "test_processor_recipes_01.json",
         "test_processor_recipes_02.json",
         "test_processor_recipes_03.json",
+        "test_where_used_01.json",
     )
     def test_main(self, value: str):
         filename: str = "test/testdata/%s" % value
@@ -171,6 +217,61 @@ class ApplicationTest(unittest.TestCase):
         application.init([APPLICATION, JsonSystemTest.filename])
         ApplicationTest.get_output(user_input, application.main)
 
+    def test_callback(self):
+        """Policy chooses the recipes instead of asking an user."""
+
+        application = Application()
+        application.init([APPLICATION, JsonSystemTest.filename])
+        application.callback = CheapestPolicy(application.calculator)
+
+        with unittest.mock.patch("builtins.input", side_effect=AssertionError):
+            output = application.process("1 cement_mixer")
+
+        self.assertNotEqual([], output)
+        self.assertEqual(
+            "advanced_armor_bench", application.calculator.stations["rope"]
+        )
+
+    def test_init_without_numpy(self):
+        """Options after -m are applied even if NumPy is missing."""
+
+        application = Application()
+        argv = [APPLICATION, "-m", "-i", "-r", FileSystemTest.filename]
+        with unittest.mock.patch("application.numpy", None):
+            output = ApplicationTest.get_output([], lambda: application.init(argv))
+
+        self.assertEqual(["No module named 'numpy'"], output)
+        self.assertIsInstance(application.algorithm, Recursive)
+        self.assertIsInstance(application.preprocessor, Implicit)
+
+    def test_where_used_options(self):
+        """Where-used does not ask which recipe to use."""
+
+        application = Application()
+        application.init([APPLICATION, "-w", JsonSystemTest.filename])
+
+        with unittest.mock.patch("builtins.input", side_effect=AssertionError):
+            output = application.process("1 rope")
+
+        self.assertIn("ROPE", output)
+        self.assertIn("lantern", output)
+        self.assertIn("rope", application.calculator.options)
+
+    def test_print_output_recursive_deep(self):
+        """Renderer should not be limited by the recursion limit."""
+
+        depth = sys.getrecursionlimit() + 100
+        application = Application()
+        for i in range(depth):
+            line = f"character : 1 item_{i} = 1 item_{i + 1}"
+            application.calculator.assign_equation(line)
+
+        tree = application.calculator.calculate_recursive(Equation("1 item_0"))
+        output = application.print_output_recursive(tree)
+
+        self.assertEqual(depth + 4, len(output))
+        self.assertEqual(" " * 2 * depth + f"1 item_{depth}", output[-1])
+
     @staticmethod
     def get_output(user_input: list[str], callback: Callable):
         with unittest.mock.patch("builtins.print") as mock_print:
@@ -0,0 +1,160 @@
+import os
+import sqlite3
+import tempfile
+import threading
+import unittest
+import unittest.mock
+
+from cache import PersistentCache, ResultCache, hash_files, hash_key
+
+
+class ResultCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.cache = ResultCache(max_entries=2, max_bytes=100)
+
+    def test_get(self):
+        self.assertIsNone(self.cache.get("a", 1))
+        self.cache.put("a", ["1 wood"], 1)
+
+        actual = self.cache.get("a", 1)
+        self.assertEqual(["1 wood"], actual)
+
+        # Cached output is not changed by the caller.
+        actual.append("1 stone")
+        self.assertEqual(["1 wood"], self.cache.get("a", 1))
+
+        expected = {"entries": 1, "bytes": 7, "hits": 2, "misses": 1}
+        self.assertEqual(expected, self.cache.stats())
+
+    def test_max_entries(self):
+        """Least recently used output is evicted first."""
+
+        self.cache.put("a", ["a"], 1)
+        self.cache.put("b", ["b"], 1)
+        self.cache.get("a", 1)
+        self.cache.put("c", ["c"], 1)
+
+        self.assertEqual(["a"], self.cache.get("a", 1))
+        self.assertIsNone(self.cache.get("b", 1))
+        self.assertEqual(["c"], self.cache.get("c", 1))
+
+    def test_max_bytes(self):
+        self.cache.put("a", ["a" * 49], 1)
+        self.cache.put("b", ["b" * 49], 1)
+        self.assertEqual(100, self.cache.stats()["bytes"])
+
+        self.cache.put("c", ["c"], 1)
+        self.assertIsNone(self.cache.get("a", 1))
+        self.assertEqual(52, self.cache.stats()["bytes"])
+
+        # Output larger than the cache is never stored.
+        self.cache.put("d", ["d" * 100], 1)
+        self.assertIsNone(self.cache.get("d", 1))
+
+    def test_version(self):
+        """Outputs are dropped when the data changes."""
+
+        self.cache.put("a", ["a"], 1)
+        self.assertIsNone(self.cache.get("a", 2))
+        self.assertEqual(0, self.cache.stats()["entries"])
+
+
+class PersistentCacheTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "results.db")
+        self.cache = PersistentCache(self.filename)
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_get(self):
+        key = hash_key(("app.py", "-i", "-r"), "2 fabricator", "FirstPolicy")
+        self.assertIsNone(self.cache.get(key, "data"))
+
+        self.cache.put(key, ["1 wood", "", "2 stone"], "data")
+        self.assertEqual(["1 wood", "", "2 stone"], self.cache.get(key, "data"))
+
+        # Outputs of other data files are never returned.
+        self.assertIsNone(self.cache.get(key, "other"))
+
+    def test_shared(self):
+        """Outputs are shared by every cache of the same file and thread."""
+
+        self.cache.put("a", ["a"], "data")
+
+        other = PersistentCache(self.filename)
+        actual: list = []
+        thread = threading.Thread(target=lambda: actual.append(other.get("a", "data")))
+        thread.start()
+        thread.join()
+
+        self.assertEqual([["a"]], actual)
+
+    def test_invalidate(self):
+        self.cache.put("a", ["a"], "old")
+        self.cache.put("b", ["b"], "new")
+        self.cache.invalidate("new")
+
+        self.assertIsNone(self.cache.get("a", "old"))
+        self.assertEqual(["b"], self.cache.get("b", "new"))
+
+    def test_error(self):
+        """Errors of the file are misses rather than failed requests."""
+
+        self.cache.put("a", ["a"], "data")
+        connection = sqlite3.connect(self.filename)
+        with connection:
+            connection.execute("DROP TABLE results")
+        connection.close()
+
+        self.cache.put("b", ["b"], "data")
+        self.assertIsNone(self.cache.get("a", "data"))
+        self.assertIsNone(self.cache.get("b", "data"))
+
+    def test_error_invalidate(self):
+        connection = sqlite3.connect(self.filename)
+        with connection:
+            connection.execute("DROP TABLE results")
+        connection.close()
+
+        self.cache.invalidate("data")
+        self.assertIsNone(self.cache.get("a", "data"))
+
+    def test_disabled(self):
+        """File which cannot be created disables the cache."""
+
+        filename = os.path.join(self.directory.name, "missing", "results.db")
+        cache = PersistentCache(filename)
+        self.assertFalse(cache.enabled)
+        self.assertTrue(self.cache.enabled)
+
+        cache.invalidate("data")
+        cache.put("a", ["a"], "data")
+        self.assertIsNone(cache.get("a", "data"))
+        self.assertFalse(os.path.exists(filename))
+
+    def test_hash_key(self):
+        """Key changes with the version of the cached outputs."""
+
+        expected = hash_key(("app.py", "-i", "-r"), "2 fabricator", "FirstPolicy")
+        with unittest.mock.patch("cache.CACHE_VERSION", 0):
+            actual = hash_key(("app.py", "-i", "-r"), "2 fabricator", "FirstPolicy")
+        self.assertNotEqual(expected, actual)
+
+    def test_hash_files(self):
+        """Hash changes with the contents of a data file."""
+
+        filename = os.path.join(self.directory.name, "tech_tree.txt")
+        with open(filename, "w") as file:
+            file.write("character : 1 stick = 1 wood")
+        expected = hash_files([filename])
+
+        self.assertEqual(expected, hash_files([filename]))
+        with open(filename, "a") as file:
+            file.write("\n")
+        self.assertNotEqual(expected, hash_files([filename]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,32 @@
+import copy
 import json
+import math
+import pickle
+import sys
 import unittest
+import unittest.mock
 from collections import deque
 from fractions import Fraction
+from random import Random
 
 from ddt import data, ddt, unpack
 from test_application import FileSystemTest, JsonSystemTest
 
 from application import FileSystem, JsonSystem
-from calculator import Calculator, Equation, EquationTree, Resource
+from calculator import (
+    Calculator,
+    CheapestPolicy,
+    Equation,
+    EquationTree,
+    ExplicitPolicy,
+    FirstPolicy,
+    Layer,
+    OptimalPolicy,
+    RecipeGraph,
+    RecipeOptimizer,
+    Resource,
+    StationPolicy,
+)
 
 
 @ddt
@@ -45,7 +64,7 @@ class ResourceTest(unittest.TestCase):
 
     def test_resource_clone(self):
         r1 = Resource("1 fiber")
-        r2 = Resource._Resource__clone(r1)
+        r2 = Resource(r1)
 
         self.assertEqual(r1, r2)
 
@@ -56,6 +75,33 @@ class ResourceTest(unittest.TestCase):
         self.assertEqual(1, r2.amount)
         self.assertEqual(r1, r2)
 
+    def test_resource_slots(self):
+        """Resources are compact and copies share the same immutable instance."""
+
+        r1 = Resource("1 fiber")
+        r2 = Resource((2, "".join(["fi", "ber"])))
+
+        self.assertFalse(hasattr(r1, "__dict__"))
+        self.assertIs(r1, Resource(r1))
+        self.assertIs(r1.name, r2.name)
+        self.assertFalse(hasattr(EquationTree(r1), "__dict__"))
+
+    def test_resource_pickle(self):
+        """Resources and equations survive copies and pickles."""
+
+        r1 = Resource("2 wood")
+        e1 = Equation("2 wood + 1/2 stone")
+
+        for copied in [
+            copy.copy(r1),
+            copy.deepcopy(r1),
+            pickle.loads(pickle.dumps(r1)),
+        ]:
+            self.assertEqual(r1, copied)
+            self.assertEqual(Fraction(2), copied.amount)
+        self.assertEqual(e1, copy.deepcopy(e1))
+        self.assertEqual(e1, pickle.loads(pickle.dumps(e1)))
+
     @data(
         ("2 biofuel_extractor", True),
         ("2 biofuel_generator", False),
@@ -101,7 +147,7 @@ class EquationTest(unittest.TestCase):
         """Equation should be immutable."""
 
         e1 = Equation("12 fiber")
-        e2 = Equation._Equation__clone(e1)
+        e2 = Equation(e1)
 
         self.assertEqual(e1, e2)
 
@@ -111,6 +157,21 @@ class EquationTest(unittest.TestCase):
 
         self.assertEqual(e1, e2)
 
+    def test_equation_resources(self):
+        """Resources should be shared rather than copied on every access."""
+
+        e1 = Equation("12 fiber + 18 stick")
+        e2 = Equation(e1)
+
+        self.assertIs(e1.resources, e1.resources)
+        self.assertIs(e1.resources, e2.resources)
+        self.assertIs(e1.resources[0], Equation(list(e1)).resources[0])
+
+        with self.assertRaises(TypeError):
+            e1.resources[0] = Resource("13 fiber")  # type: ignore
+
+        self.assertEqual("12 fiber + 18 stick", str(e1))
+
     @data(
         ("2 fiber + 4 fiber + 2 wood + 2 wood", True),
         ("2 fiber + 4 fiber + 4 wood + 0 wood", False),
@@ -138,6 +199,67 @@ class EquationTest(unittest.TestCase):
         e = Equation(value).evaluate()
         self.assertEqual(expected, str(e))
 
+    def test_evaluate_fractions(self):
+        """Integer arithmetic should round up exactly like fractions do."""
+
+        amounts = ["1/10", "3/4", "-7/25", "2", "-1/3", "5/6", "-4", "9/100"]
+        names = ["wood", "stone", "fiber"]
+        random = Random(42)
+
+        for _ in range(200):
+            resources = []
+            for _ in range(random.randint(1, 8)):
+                amount = Fraction(random.choice(amounts))
+                resources.append(Resource((amount, random.choice(names))))
+
+            expected: dict[str, Fraction] = dict()
+            for resource in resources:
+                amount = expected.get(resource.name, Fraction(0))
+                expected[resource.name] = amount + resource.amount
+
+            actual = Equation(resources).evaluate()
+            self.assertEqual(
+                [str(math.ceil(v)) for v in expected.values()],
+                [str(r.amount) for r in actual],
+            )
+            self.assertEqual(list(expected.keys()), [r.name for r in actual])
+
+    @data(
+        ("1/10 wood", 40, "4 wood", int),
+        ("1/100 steel_ingot", 16, "4/25 steel_ingot", Fraction),
+        ("3/2 sulfur", Fraction(2, 3), "1 sulfur", int),
+        ("-12 fiber", 2, "-24 fiber", int),
+    )
+    @unpack
+    def test_multiply(self, value: str, factor: Fraction, expected: str, kind: type):
+        actual = Equation(value).multiply(factor)
+
+        self.assertEqual(expected, str(actual))
+        self.assertIsInstance(actual.resources[0].amount, kind)
+
+    @data(
+        ("1 fabricator + 1 fabricator", "2 fabricator"),
+        ("2 fabricator", "2 fabricator"),
+        ("1 fabricator + 0 wood + 1 fabricator", "2 fabricator"),
+        ("1 wood + 1 anvil_bench - 1/2 wood", "1 anvil_bench + 1/2 wood"),
+        ("1 wood - 1 wood", "0 wood"),
+    )
+    @unpack
+    def test_canonical(self, value: str, expected: str):
+        self.assertEqual(expected, str(Equation(value).canonical()))
+
+    def test_canonical_hash(self):
+        """Order of the terms changes the equation but not its canonical form."""
+
+        e1 = Equation("1 fabricator + 2 anvil_bench")
+        e2 = Equation("2 anvil_bench + 1 fabricator")
+
+        self.assertNotEqual(e1, e2)
+        self.assertEqual(e1.evaluate().sort_resources(), e2.evaluate().sort_resources())
+        self.assertEqual(e1.canonical(), e2.canonical())
+        self.assertEqual(hash(e1.canonical()), hash(e2.canonical()))
+        self.assertEqual(1, len({e1.canonical(), e2.canonical()}))
+
     def test_sort_resources(self):
         """Sort by an amount then by a name."""
 
@@ -259,6 +381,19 @@ class CalculatorTest(unittest.TestCase):
         self.assertEqual("crafting_bench : 1 rope = 12 fiber", equations[1])
         self.assertEqual("character : 1 rope = 5 leather", equations[2])
 
+    def test_assign_equation_variables(self):
+        """Unassigned variables keep their order of appearance."""
+
+        calc = Calculator()
+        calc.assign_equation("character : 1 rope = 12 fiber + 2 leather")
+        calc.assign_equation("character : 1 bandage = 4 fiber + 1 wood")
+        calc.assign_equation("character : 1 leather = 1 hide")
+
+        self.assertEqual(["fiber", "wood", "hide"], list(calc.variables))
+        self.assertEqual(
+            ["rope", "bandage", "leather", "fiber", "wood", "hide"], calc.get_keywords()
+        )
+
     def test_assign_equation_3(self):
         calc = self.calc
 
@@ -337,6 +472,253 @@ class CalculatorTest(unittest.TestCase):
         self.assertEqual(["epoxy"], self.calculator.search_variable("epoxy", e1))
         self.assertEqual(["rope"], self.calculator.search_variable("rope", e1))
 
+    def test_get_graph(self):
+        graph = self.calc.get_graph()
+
+        self.assertTrue(graph.requires("hunting_rifle", "iron_ore"))
+        self.assertTrue(graph.requires("hunting_rifle", "fabricator"))
+        self.assertFalse(graph.requires("hunting_rifle", "iron_ingot"))
+        self.assertFalse(graph.requires("iron_ore", "hunting_rifle"))
+        self.assertFalse(graph.requires("steel_screw", "steel_screw"))
+
+    def test_get_graph_search_variable(self):
+        """Compiled graph should agree with the recursive search."""
+        graph = self.calc.get_graph()
+
+        for name in ["hunting_rifle", "machining_bench", "biofuel_generator"]:
+            equation = Equation([f"1 {name}"])
+            for variable in self.calc.get_keywords():
+                expected = self.calc.search_variable(variable, equation) != []
+                if variable != name:
+                    self.assertEqual(expected, graph.requires(name, variable))
+
+    def test_get_graph_assign_equation(self):
+        """Graph should be compiled again after the recipes change."""
+        calc = Calculator()
+
+        calc.assign_equation("character : 10 stick = 1 wood")
+        graph = calc.get_graph()
+        self.assertIs(graph, calc.get_graph())
+        self.assertNotIn("wood_spear", graph.requirements)
+
+        calc.assign_equation("character : 1 wood_spear = 12 fiber + 18 stick")
+        graph = calc.get_graph()
+        self.assertTrue(graph.requires("wood_spear", "wood"))
+
+    def test_get_graph_cyclic(self):
+        """Requirements do not depend on where a cycle of recipes is entered."""
+        recipes = [
+            "character : 1 fabricator = 1 carbon_fiber + 1 wood",
+            "furnace : 1 carbon_fiber = 1 carbon_paste",
+            "character : 1 furnace = 1 fabricator + 10 stone",
+        ]
+
+        for recipes in [recipes, recipes[::-1], recipes[1:] + recipes[:1]]:
+            calc = Calculator()
+            for recipe in recipes:
+                calc.assign_equation(recipe)
+            graph = calc.get_graph()
+
+            # Station is required, but not the requirements of the station.
+            self.assertTrue(graph.requires("fabricator", "carbon_paste"))
+            self.assertTrue(graph.requires("furnace", "carbon_fiber"))
+            self.assertTrue(graph.requires("carbon_fiber", "furnace"))
+            self.assertFalse(graph.requires("carbon_fiber", "fabricator"))
+            self.assertFalse(graph.requires("fabricator", "fabricator"))
+            self.assertEqual({"furnace"}, graph.workstation_sets["fabricator"])
+
+            for name in calc.resources:
+                equation = Equation([f"1 {name}"])
+                for variable in calc.get_keywords():
+                    expected = calc.search_variable(variable, equation) != []
+                    if variable != name:
+                        self.assertEqual(expected, graph.requires(name, variable))
+
+        calc = Calculator()
+        calc.assign_equation("character : 1 a = 1 b + 1 wood")
+        calc.assign_equation("character : 1 b = 1 a + 1 stone")
+        graph = calc.get_graph()
+        self.assertTrue(graph.requires("a", "b"))
+        self.assertTrue(graph.requires("b", "a"))
+        self.assertTrue(graph.requires("b", "wood"))
+        self.assertFalse(graph.requires("a", "a"))
+
+    def test_get_crafting_order_cyclic(self):
+        """Resources which require each other are crafted together."""
+        calc = Calculator()
+
+        calc.assign_equation("carpentry_bench : 1 stick = 1 wood")
+        calc.assign_equation("stone_furnace : 1 nail = 1 metal_ore")
+        calc.assign_equation("character : 1 stone_furnace = 1 stick + 1 stone")
+        calc.assign_equation("character : 1 carpentry_bench = 1 nail + 1 wood")
+        graph = calc.get_graph()
+
+        e1 = Equation("1 stone_furnace + 1 carpentry_bench")
+        expected = list(calc.find_resources(e1))
+        self.assertEqual(["stone_furnace", "carpentry_bench"], expected[:2])
+        self.assertEqual(
+            expected, graph.get_crafting_order(["stone_furnace", "carpentry_bench"])
+        )
+
+    def test_where_used(self):
+        used = self.calc.where_used("yeast")
+
+        self.assertEqual(
+            ["antibiotic_paste", "antibiotic_tonic", "beer", "bread_dough"],
+            used["ingredient"],
+        )
+        self.assertEqual([], used["station"])
+        for name in used["ingredient"] + ["bread", "antibiotic_pill"]:
+            self.assertIn(name, used["required"])
+
+        used = self.calc.where_used("potbelly_stove")
+        self.assertIn("stew", used["station"])
+        self.assertEqual(used["station"], used["required"])
+
+    def test_where_used_search_variable(self):
+        """Transitive consumers agree with the recursive search."""
+
+        for variable in ["iron_ore", "steel_bloom", "machining_bench", "fiber"]:
+            expected = []
+            for name in self.calc.resources:
+                if name != variable:
+                    if self.calc.search_variable(variable, Equation([f"1 {name}"])):
+                        expected.append(name)
+            self.assertEqual(expected, self.calc.where_used(variable)["required"])
+
+    def test_where_used_options(self):
+        """Resources with unresolved options consume through any option."""
+
+        calc = Calculator()
+        calc.assign_equation("character : 1 rope = 12 fiber")
+        calc.assign_equation("character : 1 rope = 5 leather")
+        calc.assign_equation("crafting_bench : 1 bow = 1 rope + 1 stick")
+
+        self.assertEqual(
+            {"ingredient": ["rope"], "station": [], "required": ["bow", "rope"]},
+            calc.where_used("leather"),
+        )
+        self.assertEqual(["rope"], calc.where_used("character")["station"])
+
+        # Only the chosen recipe consumes after the option is resolved.
+        calc.resolve_option("rope", 0)
+        self.assertEqual([], calc.where_used("leather")["ingredient"])
+        self.assertEqual(["bow", "rope"], calc.where_used("fiber")["required"])
+
+    def test_where_used_options_read_json(self):
+        used = self.calculator.where_used("leather")
+
+        parse = self.calculator.validator.parse_assignment
+        for name, options in self.calculator.options.items():
+            for option in options:
+                if "leather" in [r.name for r in parse(option)[2]]:
+                    self.assertIn(name, used["ingredient"])
+        self.assertIn("rope", used["ingredient"])
+        for name in used["ingredient"]:
+            self.assertIn(name, used["required"])
+
+    def test_get_bill(self):
+        bill = self.calc.get_graph().get_bill("anvil_bench")
+
+        expected = {"iron_ore": 80, "wood": 20, "stone": 10}
+        self.assertEqual(expected, bill.materials)
+
+        expected = {
+            "crafting_bench": {"anvil_bench": 1},
+            "stone_furnace": {"iron_ingot": 40},
+        }
+        self.assertEqual(expected, bill.stations)
+
+        # Bills of materials are memoized per resource.
+        self.assertIs(bill, self.calc.get_graph().get_bill("anvil_bench"))
+
+    def test_get_bill_exact(self):
+        """Intermediate steps are not rounded up in the bills of materials."""
+
+        bill = self.calc.get_graph().get_bill("steel_screw")
+        expected = {"iron_ore": Fraction(3, 50), "coal_ore": Fraction(1, 100)}
+        self.assertEqual(expected, bill.materials)
+
+    def test_calculate_total(self):
+        """Scaled bills of materials agree with calculate on every resource."""
+
+        graph = self.calc.get_graph()
+        self.assertEqual(10, graph.get_bill("fabricator").denominator)
+        self.assertEqual(1, graph.get_bill("anvil_bench").denominator)
+
+        random = Random(42)
+        for name in self.calc.resources:
+            denominator = graph.get_bill(name).denominator
+            for amount in [1, denominator, random.randint(1, 5) * denominator]:
+                e1 = f"{amount} {name}"
+                expected = Equation(self.get_last_element(e1)).sort_resources()
+                actual = self.calc.calculate_total(Equation(e1)).sort_resources()
+                self.assertEqual(expected, actual)
+
+        for e1 in [
+            "37 steel_screw + 4 fabricator",
+            "100 steel_screw + 20 fabricator + 100 steel_screw",
+            "3 electric_extractor - 20 sulfur",
+        ]:
+            expected = Equation(self.get_last_element(e1)).sort_resources()
+            actual = self.calc.calculate_total(Equation(e1)).sort_resources()
+            self.assertEqual(expected, actual)
+
+    def test_calculate_total_linear(self):
+        """Recipes are not substituted when nothing would be rounded up."""
+
+        e1 = Equation("200 steel_screw + 20 fabricator")
+        steps = iter([Equation("1 wood")])
+        with unittest.mock.patch.object(
+            self.calc, "calculate", return_value=steps
+        ) as calculate:
+            self.calc.calculate_total(e1)
+            self.calc.calculate_total(Equation("4 fabricator"))
+
+        self.assertEqual(1, calculate.call_count)
+
+    def test_calculate_total_partial_amounts(self):
+        """Partial amounts are rounded up even when their sum is whole."""
+        calc = Calculator()
+
+        calc.assign_equation("character : 10 stick = 1 wood")
+        calc.assign_equation("crafting_bench : 2 plank = 1 wood")
+        calc.assign_equation("anvil_bench : 1 x = 5 stick + 1 plank")
+        self.assertEqual(2, calc.get_graph().get_bill("x").denominator)
+
+        for e1 in ["1 x", "2 x", "3 x"]:
+            expected = deque(calc.calculate(Equation(e1)), maxlen=1).pop()
+            actual = calc.calculate_total(Equation(e1))
+            self.assertEqual(expected.sort_resources(), actual.sort_resources())
+        self.assertEqual("2 wood", str(calc.calculate_total(Equation("1 x"))))
+
+    def test_calculate_total_cyclic(self):
+        """Bills of cyclic recipes are incomplete, so they are never scaled."""
+        calc = Calculator()
+
+        calc.assign_equation("character : 1 a = 1 b + 1 wood")
+        calc.assign_equation("character : 1 b = 1 a + 1 stone")
+        calc.assign_equation("character : 1 c = 1 a")
+        self.assertEqual(0, calc.get_graph().get_bill("c").denominator)
+
+    def test_calculate_total_assign_equation(self):
+        """Memoized bills of materials should follow the recipe changes."""
+        calc = Calculator()
+
+        calc.assign_equation("character : 10 stick = 1 wood")
+        calc.assign_equation("character : 10 stick = 2 fiber")
+        calc.assign_equation("character : 1 wood_spear = 12 fiber + 18 stick")
+
+        equation = Equation("1 wood_spear")
+        self.assertEqual("12 fiber + 18 stick", str(calc.calculate_total(equation)))
+
+        line = calc.options["stick"][0]
+        del calc.options["stick"]
+        calc.assign_equation(line)
+
+        expected = "12 fiber + 2 wood"
+        self.assertEqual(expected, str(calc.calculate_total(equation)))
+
     def test_calculate_last_element(self):
         """Equation should contain only raw materials as the last element."""
 
@@ -533,6 +915,17 @@ class CalculatorTest(unittest.TestCase):
 
         self.assertEqual("concrete_furnace", self.calc.order_by_station([r1, r2]))
 
+    def test_get_graph_station_values(self):
+        """Every station has its tier precomputed in the graph."""
+
+        graph = self.calc.get_graph()
+        for station in self.calc.stations.values():
+            self.assertIn(station, graph.station_values)
+        self.assertEqual(4, graph.station_values["fabricator"])
+
+        self.calc.assign_equation("fabricator : 1 robot = 1 fabricator")
+        self.assertEqual(5, self.calc.get_station_value("robot"))
+
     def test_get_station_value(self):
         self.assertEqual(1, self.calc.get_station_value("character_crafting"))
         self.assertEqual(2, self.calc.get_station_value("crafting_bench"))
@@ -802,6 +1195,19 @@ class CalculatorTest(unittest.TestCase):
                 "1 anvil_bench",
             ],
         },
+        {
+            "user_input": [
+                "1 alteration_bench",
+            ],
+            "expected_output": [
+                "1 alteration_bench",
+                "1 machining_bench",
+                "1 stone_furnace",
+                "1 mortar_and_pestle",
+                "1 anvil_bench",
+                "1 crafting_bench",
+            ],
+        },
     )
     @unpack
     def test_find_workstations(self, user_input, expected_output):
@@ -811,7 +1217,42 @@ class CalculatorTest(unittest.TestCase):
 
         self.assertEqual(expected, actual)
 
+    def test_find_workstations_by_resources(self):
+        """Precomputed workstations agree with substituting the recipes."""
+
+        for value in [
+            "1 fabricator + 1 machining_bench",
+            "3 electric_extractor + 10 concrete_mix",
+            "1 biofuel_extractor + 1 biofuel_generator",
+            "2 anvil_bench + 1 crafting_bench",
+        ]:
+            equation = Equation(value)
+            expected = self.calc.find_workstations_by_resources(equation)
+            actual = self.calc.find_workstations(equation)
+            self.assertEqual(str(expected), str(actual))
+
+    def test_get_crafting_order(self):
+        graph = self.calc.get_graph()
+
+        self.assertEqual(
+            ["anvil_bench", "iron_ingot"], graph.get_crafting_order(["anvil_bench"])
+        )
+        self.assertEqual(
+            list(self.calc.find_resources(Equation("3 electric_extractor"))),
+            graph.get_crafting_order(["electric_extractor"]),
+        )
+
+    def test_get_graph_workstation_sets(self):
+        graph = self.calc.get_graph()
+
+        self.assertEqual(frozenset(), graph.workstation_sets["crafting_bench"])
+        self.assertEqual(
+            {"crafting_bench", "stone_furnace"}, graph.workstation_sets["anvil_bench"]
+        )
+        self.assertEqual(frozenset(), graph.workstation_sets["wood"])
 
+
+@ddt
 class ValidatorTest(unittest.TestCase):
     def setUp(self) -> None:
         """Create a calculator before any test method."""
@@ -828,12 +1269,55 @@ class ValidatorTest(unittest.TestCase):
             self.calculator.validator.validate_value_calculation(equation)
         self.assertEqual(expected, str(err.exception))
 
+    def test_validate_value_calculation_mixed_errors(self):
+        """Unknown names and raw materials are reported in the input order."""
+
+        equation = Equation("1 wood + 1 foo + 2 wood")
+        expected = "ValueError: 1 wood, foo, 2 wood"
+
+        with self.assertRaises(ValueError) as err:
+            self.calculator.validator.validate_value_calculation(equation)
+        self.assertEqual(expected, str(err.exception))
+
     def test_validate_value_calculation_optional_recipe(self):
         """Optional recipe is valid input should not raise an error."""
 
         e1 = Equation("1 concrete_mix")
         self.calculator.validator.validate_value_calculation(e1)
 
+    @data(
+        ("1 wood + 2 stone", "1 wood + 2 stone"),
+        ("-1 stone + 1/2 wood", "-1 stone + 1/2 wood"),
+        ("12 fiber - 3 fiber", "12 fiber - 3 fiber"),
+    )
+    @unpack
+    def test_parse_calculation(self, value: str, expected: str):
+        equation = self.calculator.validator.parse_calculation(value)
+        self.assertEqual(Equation(expected), equation)
+
+    @data(
+        ("1 wood + 2 stone +", 7),
+        ("1 wood 2 stone", 1),
+        ("1 wood + 2 Stone", 7),
+        ("1 wood - -2 stone", 7),
+    )
+    @unpack
+    def test_parse_calculation_error(self, value: str, offset: int):
+        """Syntax error points at the first term that could not be parsed."""
+
+        with self.assertRaises(SyntaxError) as err:
+            self.calculator.validator.parse_calculation(value)
+        self.assertEqual(f"SyntaxError: {value}", str(err.exception))
+        self.assertEqual(offset, err.exception.offset)
+
+    def test_parse_assignment(self):
+        line = "crafting_bench : 2 rope = 12 fiber + 1 leather"
+        station, resource, equation = self.calculator.validator.parse_assignment(line)
+
+        self.assertEqual("crafting_bench", station)
+        self.assertEqual(Resource("2 rope"), resource)
+        self.assertEqual(Equation("12 fiber + 1 leather"), equation)
+
 
 class EquationTreeTest(unittest.TestCase):
     def setUp(self) -> None:
@@ -992,6 +1476,20 @@ class EquationTreeTest(unittest.TestCase):
         self.assertEqual(a5, a6)
         self.assertEqual(a7, a8)
 
+    def test_calculate_recursive_shared_subtrees(self):
+        """Identical subtrees are built once and shared between branches."""
+
+        e1 = Equation("1 anvil_bench + 1 machining_bench")
+        a1 = self.calculator.calculate_recursive(e1)
+        anvil_bench, machining_bench = a1.children
+
+        self.assertEqual("40 iron_ingot", str(anvil_bench.children[0]))
+        self.assertEqual("40 iron_ingot", str(machining_bench.children[3]))
+        self.assertIs(anvil_bench.children[0], machining_bench.children[3])
+
+        # Shared subtrees are expanded when the tree is traversed.
+        self.assertEqual(2, [str(r) for r in a1].count("80 iron_ore"))
+
     def test_calculate_recursive_crafting_order(self):
         e1 = Equation("1 biofuel_generator + 1 biofuel_extractor")
         a1 = self.calculator.calculate_recursive(e1)
@@ -1016,6 +1514,424 @@ class EquationTreeTest(unittest.TestCase):
         self.assertEqual(a2, str(self.calculator.arrange_resources(e2)))
         self.assertEqual(a3, str(self.calculator.arrange_resources(e3)))
 
+    def test_arrange_resources_raw_materials(self):
+        """Duplicates stay together and uncraftable resources go first."""
+
+        e1 = Equation(
+            "1 machining_bench + 5 wood - 10 epoxy + 1 crafting_bench + 1 machining_bench"
+        )
+        a1 = "-10 epoxy + 5 wood + 1 crafting_bench + 1 machining_bench + 1 machining_bench"
+
+        e2 = Equation(
+            "2 iron_ingot + 1 anvil_bench + 0 fabricator + 1 stone_furnace + 3 iron_ingot"
+        )
+        a2 = "0 fabricator + 1 stone_furnace + 2 iron_ingot + 3 iron_ingot + 1 anvil_bench"
+
+        self.assertEqual(a1, str(self.calculator.arrange_resources(e1)))
+        self.assertEqual(a2, str(self.calculator.arrange_resources(e2)))
+
+
+@ddt
+class PolicyTest(unittest.TestCase):
+    def setUp(self) -> None:
+        """Game file has several recipes for many resources."""
+
+        self.calculator = Calculator()
+        file = JsonSystem(JsonSystemTest.filename)
+        file.read(self.calculator)
+
+    @data(
+        (FirstPolicy, "stick", 0),
+        (FirstPolicy, "wood_floor", 0),
+        (CheapestPolicy, "wood_floor", 1),
+        (CheapestPolicy, "rope", 1),
+        (StationPolicy, "stick", 2),
+        (StationPolicy, "wood_floor", 0),
+        (OptimalPolicy, "wood_floor", 1),
+        (OptimalPolicy, "rope", 1),
+    )
+    @unpack
+    def test_choose(self, policy: type, name: str, expected: int):
+        options = self.calculator.options[name]
+        self.assertEqual(expected, policy(self.calculator).choose(options))
+
+    def test_resolve_recipes(self):
+        """Options are resolved without asking an user."""
+
+        e1 = Equation("1 wood_floor")
+        self.calculator.resolve_recipes(e1, CheapestPolicy(self.calculator))
+
+        self.assertNotIn("wood_floor", self.calculator.options)
+        self.assertEqual("carpentry_bench", self.calculator.stations["wood_floor"])
+
+    @data(CheapestPolicy, StationPolicy)
+    def test_resolve_recipes_compiled_once(self, policy: type):
+        """Options are compared on a graph which is compiled once."""
+
+        e1 = Equation("1 fabricator + 1 cement_mixer + 1 kitchen_bench")
+        with unittest.mock.patch("calculator.RecipeGraph", wraps=RecipeGraph) as graph:
+            self.calculator.resolve_recipes(e1, policy(self.calculator))
+
+        self.assertEqual(1, graph.call_count)
+        self.assertNotIn("rope", self.calculator.options)
+
+    def test_choices(self):
+        """Choices are kept per policy until the recipes change."""
+
+        policy = StationPolicy(self.calculator)
+        self.assertEqual(2, policy(self.calculator.options["stick"]))
+        self.assertEqual(0, policy(self.calculator.options["wood_floor"]))
+        self.calculator.resolve_option("stick", 2)
+
+        choices = self.calculator.choices["StationPolicy"]
+        self.assertEqual(2, len(choices))
+        self.assertNotIn("FirstPolicy", self.calculator.choices)
+
+        self.calculator.assign_equation("character : 1 robot = 1 wood")
+        self.assertEqual({}, self.calculator.choices)
+
+    def test_explicit(self):
+        fallback = CheapestPolicy(self.calculator)
+        policy = ExplicitPolicy(self.calculator, {"wood_floor": "2"}, fallback)
+
+        self.assertEqual("CheapestPolicy:wood_floor=2", policy.key)
+        self.assertEqual(2, policy(self.calculator.options["wood_floor"]))
+        self.assertEqual(1, policy(self.calculator.options["rope"]))
+
+    def test_explicit_error(self):
+        """Every choice is checked, even if no option reaches it."""
+
+        fallback = FirstPolicy(self.calculator)
+        for name, choice in [("wood_floor", "3"), ("rope", "x"), ("wood", "0")]:
+            with self.assertRaises(ValueError) as err:
+                ExplicitPolicy(self.calculator, {name: choice}, fallback)
+            self.assertEqual(f"ValueError: {name}={choice}", str(err.exception))
+
+    def test_optimal(self):
+        """Every option of the game file is chosen at once."""
+
+        optimizer = RecipeOptimizer(self.calculator)
+        for name in self.calculator.get_keywords():
+            optimizer.get_cost(name)
+
+        for name, options in self.calculator.options.items():
+            self.assertIn(optimizer.choices[name], range(len(options)))
+
+        e1 = Equation("1 cement_mixer")
+        self.assertEqual(0, optimizer.choose("refined_metal"))
+        self.assertEqual(1, optimizer.choose("rope"))
+
+        self.calculator.resolve_recipes(e1, OptimalPolicy(self.calculator))
+        self.assertNotIn("rope", self.calculator.options)
+        self.assertEqual("advanced_armor_bench", self.calculator.stations["rope"])
+
+
+class OverlayTest(unittest.TestCase):
+    def setUp(self) -> None:
+        """Game file has several recipes for many resources."""
+
+        self.calculator = Calculator()
+        file = JsonSystem(JsonSystemTest.filename)
+        file.read(self.calculator)
+
+    def test_overlay(self):
+        """Recipes are shared until an option is resolved."""
+
+        overlay = self.calculator.overlay()
+        self.assertIs(self.calculator.resources, overlay.resources)
+        self.assertIs(self.calculator.options, overlay.options)
+        self.assertIs(self.calculator.get_graph(), overlay.get_graph())
+        self.assertIs(overlay, overlay.validator.calc)
+
+        overlay.resolve_recipes(Equation("1 wood_floor"), lambda options: 1)
+
+        self.assertIsNot(self.calculator.resources, overlay.resources)
+        self.assertNotIn("wood_floor", overlay.options)
+        self.assertIn("wood_floor", overlay.resources)
+        self.assertIn("wood_floor", self.calculator.options)
+        self.assertNotIn("wood_floor", self.calculator.resources)
+
+    def test_overlay_choices(self):
+        """Overlays resolve the same option independently of each other."""
+
+        e1 = Equation("1 cement_mixer")
+        o1 = self.calculator.overlay()
+        o2 = self.calculator.overlay()
+        o1.resolve_recipes_implicit(e1, FirstPolicy(o1))
+        o2.resolve_recipes_implicit(e1, CheapestPolicy(o2))
+
+        self.assertEqual("crafting_bench", o1.stations["rope"])
+        self.assertEqual("advanced_armor_bench", o2.stations["rope"])
+        self.assertIn("rope", self.calculator.options)
+        self.assertEqual({}, self.calculator.choices)
+
+        # Shared dependency graph is compiled from the unresolved recipes.
+        self.assertIn("rope", o1.get_graph().recipes)
+        self.assertNotIn("rope", self.calculator.get_graph().recipes)
+
+    def test_overlay_graph(self):
+        """Resolved options are added to the graph of the overlay only."""
+
+        graph = self.calculator.get_graph()
+        requirements = dict(graph.requirements)
+
+        e1 = Equation("1 fabricator + 1 cement_mixer + 1 kitchen_bench")
+        overlay = self.calculator.overlay()
+        with unittest.mock.patch("calculator.RecipeGraph", wraps=RecipeGraph) as cls:
+            overlay.resolve_recipes(e1, FirstPolicy(overlay))
+            layered = overlay.get_graph()
+        self.assertEqual(0, cls.call_count)
+
+        # Layered graph is the same as a graph compiled from the overlay.
+        compiled = RecipeGraph(overlay)
+        self.assertEqual(dict(compiled.requirements), dict(layered.requirements))
+        self.assertEqual(
+            dict(compiled.workstation_sets), dict(layered.workstation_sets)
+        )
+        self.assertEqual(compiled.get_users("fiber"), layered.get_users("fiber"))
+        self.assertEqual(
+            compiled.get_crafting_order(["fabricator", "rope"]),
+            layered.get_crafting_order(["fabricator", "rope"]),
+        )
+
+        self.assertIs(graph, self.calculator.get_graph())
+        self.assertEqual(requirements, graph.requirements)
+
+    def test_keep_graph(self):
+        """Options are compared on the graph as it was before resolving."""
+
+        graph = self.calculator.keep_graph()
+        e1 = Equation("1 cement_mixer")
+        self.calculator.resolve_recipes(e1, FirstPolicy(self.calculator))
+
+        self.assertNotIn("rope", graph.recipes)
+        self.assertIn("rope", self.calculator.get_graph().recipes)
+        self.assertIsNot(graph, self.calculator.get_graph())
+        self.assertFalse(self.calculator.shared)
+
+    def test_overlay_policy(self):
+        """Policy of an overlay leaves the shared recipes untouched."""
+
+        graph = self.calculator.get_graph()
+        e1 = Equation("1 cement_mixer")
+        for policy in [CheapestPolicy, StationPolicy, OptimalPolicy]:
+            overlay = self.calculator.overlay()
+            overlay.resolve_recipes_implicit(e1, policy(overlay))
+            self.assertNotIn("rope", overlay.options)
+            self.assertNotEqual({}, overlay.choices)
+
+        self.assertEqual({}, self.calculator.choices)
+        self.assertFalse(self.calculator.shared)
+        self.assertIs(graph, self.calculator.get_graph())
+        self.assertNotIn("rope", graph.recipes)
+        self.assertIn("rope", self.calculator.options)
+
+    def test_layer(self):
+        """Changes and removals are kept apart from the shared dictionary."""
+
+        shared = {"a": 1, "b": 2, "c": 3}
+        layer = Layer(shared)
+        layer["b"] = 20
+        layer["d"] = 4
+        del layer["a"]
+        self.assertEqual(3, layer.pop("c"))
+        self.assertIsNone(layer.pop("c", None))
+        self.assertRaises(KeyError, layer.pop, "c")
+
+        self.assertEqual({"b": 20, "d": 4}, dict(layer))
+        self.assertEqual(["b", "d"], list(layer))
+        self.assertEqual(2, len(layer))
+        self.assertNotIn("a", layer)
+        self.assertIsNone(layer.get("a"))
+        self.assertRaises(KeyError, lambda: layer["c"])
+
+        # Removed key which is assigned again is moved to the end.
+        layer["a"] = 10
+        self.assertEqual(["b", "d", "a"], list(layer))
+        self.assertEqual({"a": 1, "b": 2, "c": 3}, shared)
+
+
+class OptimizerTest(unittest.TestCase):
+    def setUp(self) -> None:
+        """Cheapest recipe depends on the options of its ingredients."""
+
+        self.calculator = Calculator()
+        self.calculator.options["rope"] = [
+            "crafting_bench : 1 rope = 1 cord",
+            "crafting_bench : 2 rope = 6 fiber",
+        ]
+        self.calculator.options["cord"] = [
+            "crafting_bench : 1 cord = 10 fiber",
+            "crafting_bench : 1 cord = 1 leather",
+        ]
+
+    def test_get_cost(self):
+        optimizer = RecipeOptimizer(self.calculator)
+        self.assertEqual(1, optimizer.get_cost("rope"))
+        self.assertEqual(0, optimizer.choose("rope"))
+        self.assertEqual(1, optimizer.choose("cord"))
+
+        optimizer = RecipeOptimizer(self.calculator, {"leather": Fraction(5)})
+        self.assertEqual(3, optimizer.get_cost("rope"))
+        self.assertEqual(1, optimizer.choose("rope"))
+
+    def test_policy(self):
+        """Cheapest policy counts unresolved options as raw materials."""
+
+        weights = {"leather": Fraction(5)}
+        policy = OptimalPolicy(self.calculator, weights)
+
+        self.assertEqual("OptimalPolicy:leather=5", policy.key)
+        self.assertEqual(1, policy(self.calculator.options["rope"]))
+        self.assertEqual(
+            0, CheapestPolicy(self.calculator)(self.calculator.options["rope"])
+        )
+
+    def test_cyclic_recipes(self):
+        """Recipe which needs the resource itself is never chosen."""
+
+        self.calculator.options["cord"].insert(0, "crafting_bench : 1 cord = 1 rope")
+
+        optimizer = RecipeOptimizer(self.calculator)
+        self.assertEqual(1, optimizer.get_cost("rope"))
+        self.assertEqual(2, optimizer.choose("cord"))
+
+    def test_cyclic_recipes_entry(self):
+        """Cost in a cycle is the same wherever the search enters it."""
+
+        self.calculator.options["cord"].insert(0, "crafting_bench : 1 cord = 1 rope")
+        self.calculator.options["cord"][2] = "crafting_bench : 1 cord = 4 leather"
+
+        for names in [["rope", "cord"], ["cord", "rope"]]:
+            optimizer = RecipeOptimizer(self.calculator)
+            for name in names:
+                optimizer.get_cost(name)
+
+            self.assertEqual(3, optimizer.costs["rope"])
+            self.assertEqual(3, optimizer.costs["cord"])
+            self.assertEqual({"rope": 1, "cord": 0}, optimizer.choices)
+
+
+class DeepTechTreeTest(unittest.TestCase):
+    def setUp(self) -> None:
+        """Recipe chain is longer than the recursion limit."""
+
+        self.depth = sys.getrecursionlimit() + 100
+        self.calculator = Calculator()
+        for i in range(self.depth - 1):
+            self.calculator.assign_equation(f"character : 1 item_{i} = 1 item_{i + 1}")
+        self.calculator.assign_equation(f"character : 1 item_{self.depth - 1} = 1 wood")
+
+    def test_calculate_recursive(self):
+        e1 = Equation("1 item_0")
+        a1 = self.calculator.calculate_recursive(e1)
+
+        actual = [str(r) for r in a1]
+        self.assertEqual(self.depth + 1, len(actual))
+        self.assertEqual("1 wood", actual[-1])
+
+        dictionaries = self.calculator.convert_to_dictionaries(a1)
+        for _ in range(self.depth + 1):
+            self.assertEqual(1, len(dictionaries))
+            dictionaries = dictionaries[0]["children"]
+        self.assertEqual([], dictionaries)
+
+    def test_search_variable(self):
+        e1 = Equation("1 item_0")
+        self.assertEqual(["item_0"], self.calculator.search_variable("wood", e1))
+
+    def test_calculate_total(self):
+        e1 = Equation("1 item_0")
+        self.assertEqual("1 wood", str(self.calculator.calculate_total(e1)))
+
+        graph = self.calculator.get_graph()
+        self.assertTrue(graph.requires("item_0", "wood"))
+
+
+class DiamondTechTreeTest(unittest.TestCase):
+    def setUp(self) -> None:
+        """Every item needs two items which both need the same item."""
+
+        self.depth = 40
+        self.calculator = Calculator()
+        for i in range(self.depth):
+            self.calculator.assign_equation(
+                f"character : 1 item_{i} = 1 left_{i} + 1 right_{i}"
+            )
+            self.calculator.assign_equation(f"character : 1 left_{i} = 1 item_{i + 1}")
+            self.calculator.assign_equation(f"character : 1 right_{i} = 1 item_{i + 1}")
+        self.calculator.assign_equation(f"character : 1 item_{self.depth} = 1 wood")
+        self.calculator.options["wood"] = [
+            "character : 1 wood = 1 stick",
+            "character : 1 wood = 1 fiber",
+        ]
+
+    def test_resolve_recipes(self):
+        """Shared ingredients are expanded only once."""
+
+        calls = []
+        e1 = Equation("1 item_0")
+        self.calculator.resolve_recipes(e1, lambda options: calls.append(options) or 1)
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual("1 fiber", str(self.calculator.resources["wood"]))
+
+    def test_resolve_recipes_implicit(self):
+        calls = []
+        e1 = Equation("1 item_0")
+        self.calculator.resolve_recipes_implicit(
+            e1, lambda options: calls.append(options) or 0
+        )
+
+        self.assertEqual(1, len(calls))
+        self.assertEqual("1 stick", str(self.calculator.resources["wood"]))
+
+    def test_resolve_recipes_expansions(self):
+        """Every recipe is expanded once rather than once per path to it."""
+
+        class Recipes(dict):
+            expansions = 0
+
+            def __getitem__(self, name):
+                Recipes.expansions += 1
+                return super().__getitem__(name)
+
+        for resolve in ["resolve_recipes", "resolve_recipes_implicit"]:
+            Recipes.expansions = 0
+            calculator = Calculator()
+            calculator.resources = Recipes(self.calculator.resources)
+            calculator.stations = self.calculator.stations
+            calculator.options = dict(self.calculator.options)
+
+            getattr(calculator, resolve)(Equation("1 item_0"), lambda options: 0)
+            self.assertEqual(len(calculator.resources), Recipes.expansions)
+
+    def test_resolve_recipes_order(self):
+        """Options are asked breadth first, nearest to the input first."""
+
+        calculator = Calculator()
+        calculator.assign_equation("character : 1 tool = 1 handle + 1 blade")
+        calculator.assign_equation("character : 1 handle = 1 grip")
+        calculator.assign_equation("character : 1 grip = 1 deep")
+        calculator.assign_equation("character : 1 blade = 1 shallow + 1 grip")
+        for name in ["deep", "shallow"]:
+            calculator.assign_equation(f"character : 1 {name} = 1 wood")
+            calculator.assign_equation(f"character : 1 {name} = 1 stone")
+
+        expected = ["character : 1 shallow = 1 wood", "character : 1 deep = 1 wood"]
+
+        calls: list[str] = []
+        overlay = calculator.overlay()
+        overlay.resolve_recipes(Equation("1 tool"), lambda o: calls.append(o[0]) or 0)
+        self.assertEqual(expected, calls)
+
+        calls.clear()
+        overlay = calculator.overlay()
+        overlay.resolve_recipes_implicit(
+            Equation("1 tool"), lambda o: calls.append(o[0]) or 0
+        )
+        self.assertEqual(expected, calls)
+
 
 if __name__ == "__main__":
     unittest.main()
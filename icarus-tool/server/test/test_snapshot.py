@@ -0,0 +1,136 @@
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+from test_application import FileSystemTest
+
+from application import Application
+from calculator import Equation
+from snapshot import load_snapshot, save_snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.filename = os.path.join(self.directory.name, "tech_tree.txt")
+        shutil.copy(FileSystemTest.filename, self.filename)
+
+        self.application = Application()
+        self.application.init(["app.py", self.filename])
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_load_snapshot(self):
+        """Snapshot gives the same results as the text file."""
+
+        self.assertIsNone(load_snapshot([self.filename]))
+        save_snapshot(self.application.calculator, [self.filename])
+
+        expected = self.application.calculator
+        actual = load_snapshot([self.filename])
+
+        self.assertIsNotNone(actual)
+        self.assertEqual(expected.resources, actual.resources)
+        self.assertEqual(expected.stations, actual.stations)
+        self.assertEqual(list(expected.variables), list(actual.variables))
+        self.assertIsNotNone(actual.graph)
+        self.assertIs(actual, actual.validator.calc)
+        self.assertEqual(vars(expected.get_graph()).keys(), vars(actual.graph).keys())
+
+        for value in ["1 fabricator", "37 steel_screw + 4 fabricator"]:
+            equation = Equation(value)
+            self.assertEqual(
+                list(expected.calculate(equation)), list(actual.calculate(equation))
+            )
+            self.assertEqual(expected.where_used("wood"), actual.where_used("wood"))
+
+    def test_init(self):
+        """Application reads a fresh snapshot instead of the text file."""
+
+        save_snapshot(self.application.calculator, [self.filename])
+
+        application = Application()
+        with unittest.mock.patch("application.FileSystem.read") as read:
+            application.init(["app.py", "-r", "-s", self.filename])
+
+        read.assert_not_called()
+        self.assertEqual([self.filename], application.files)
+        self.assertEqual(
+            len(self.application.calculator.resources),
+            len(application.calculator.resources),
+        )
+
+        expected = Application()
+        expected.init(["app.py", "-r", self.filename])
+        self.assertEqual(
+            expected.process("1 fabricator"), application.process("1 fabricator")
+        )
+
+    def test_init_without_flag(self):
+        """Snapshot is loaded only when the option asks for it."""
+
+        save_snapshot(self.application.calculator, [self.filename])
+
+        application = Application()
+        with unittest.mock.patch("application.load_snapshot") as load:
+            application.init(["app.py", "-r", self.filename])
+
+        load.assert_not_called()
+        self.assertEqual(
+            self.application.calculator.resources.keys(),
+            application.calculator.resources.keys(),
+        )
+
+    def test_outdated(self):
+        """Snapshot is ignored when the text file changes."""
+
+        save_snapshot(self.application.calculator, [self.filename])
+        with open(self.filename, "a") as file:
+            file.write("character : 1 robot = 1 wood\n")
+
+        self.assertIsNone(load_snapshot([self.filename]))
+
+        application = Application()
+        application.init(["app.py", self.filename])
+        self.assertIn("robot", application.calculator.resources)
+
+    def test_version(self):
+        """Body of a snapshot is not decoded when the header differs."""
+
+        save_snapshot(self.application.calculator, [self.filename])
+
+        with unittest.mock.patch("snapshot.VERSION", 0):
+            with unittest.mock.patch("marshal.loads") as load:
+                self.assertIsNone(load_snapshot([self.filename]))
+        load.assert_not_called()
+
+    def test_error(self):
+        """Programming errors are raised rather than taken as a broken snapshot."""
+
+        save_snapshot(self.application.calculator, [self.filename])
+
+        with unittest.mock.patch("snapshot.decode_equation", side_effect=NameError):
+            with self.assertRaises(NameError):
+                load_snapshot([self.filename])
+
+    def test_broken(self):
+        """Broken snapshot is ignored rather than an error."""
+
+        filename = save_snapshot(self.application.calculator, [self.filename])
+        with open(filename, "rb") as file:
+            header = file.readline()
+        with open(filename, "wb") as file:
+            file.write(header + b"broken")
+
+        self.assertIsNone(load_snapshot([self.filename]))
+
+        application = Application()
+        application.init(["app.py", "-s", self.filename])
+        self.assertIn("fabricator", application.calculator.resources)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+import unittest
+from collections import deque
+
+from test_application import FileSystemTest
+
+from application import Application, FileSystem
+from calculator import Calculator, Equation, Resource
+from solver import MatrixSolver, numpy
+
+
+@unittest.skipUnless(numpy, "NumPy is an optional dependency.")
+class MatrixSolverTest(unittest.TestCase):
+    def setUp(self) -> None:
+        self.calculator = Calculator()
+        filesystem = FileSystem(FileSystemTest.filename)
+        filesystem.read(self.calculator)
+
+        self.solver = MatrixSolver(self.calculator)
+
+    def test_calculate(self):
+        """Solver should agree with the iterative algorithm on whole numbers."""
+
+        for value in [
+            "1 crafting_bench + 1 anvil_bench",
+            "3 electric_extractor",
+            "1 stone_furnace + 1 anvil_bench + 1 machining_bench - 102 stone",
+        ]:
+            equation = Equation(value)
+            iterator = self.calculator.calculate(equation)
+            expected = deque(iterator, maxlen=1).pop().sort_resources()
+            actual = self.solver.calculate(equation).sort_resources()
+            self.assertEqual(expected, actual)
+
+    def test_calculate_nonpositive(self):
+        """Subtracted intermediate steps are the same as in the iterative algorithm."""
+
+        for value in [
+            "1 stone_furnace + 1 anvil_bench - 10 epoxy",
+            "1 machining_bench - 2 anvil_bench",
+            "1 fabricator + 0 machining_bench",
+        ]:
+            equation = Equation(value)
+            iterator = self.calculator.calculate(equation)
+            expected = deque(iterator, maxlen=1).pop().sort_resources()
+            actual = self.solver.calculate(equation).sort_resources()
+            self.assertEqual(expected, actual)
+
+    def test_calculate_rounding(self):
+        """Amounts are rounded up once rather than after every step."""
+
+        e1 = Equation("16 steel_screw")
+        self.assertEqual("1 iron_ore + 1 coal_ore", str(self.solver.calculate(e1)))
+
+    def test_calculate_all(self):
+        """Every recipe should be solved at once."""
+
+        everything = self.solver.calculate_all()
+
+        self.assertCountEqual(self.calculator.resources, everything)
+        for name in ["crafting_bench", "machining_bench", "fabricator"]:
+            # Exact bill of materials is rounded up only once.
+            bill = self.calculator.get_graph().get_bill(name)
+            expected = Equation([Resource((v, k)) for k, v in bill.materials.items()])
+            self.assertEqual(
+                expected.evaluate().sort_resources(),
+                everything[name].sort_resources(),
+            )
+
+    def test_calculate_sparse(self):
+        """Only the ingredients of the recipes are stored."""
+
+        ingredients = sum(len(v.resources) for v in self.calculator.resources.values())
+        stored = sum(len(values) for _, _, values in self.solver.batches)
+        self.assertEqual(ingredients, stored)
+
+    def test_calculate_cyclic(self):
+        calculator = Calculator()
+        calculator.assign_equation("character : 1 a = 1 b + 1 wood")
+        calculator.assign_equation("character : 1 b = 1 a + 1 stone")
+
+        with self.assertRaises(ValueError) as err:
+            MatrixSolver(calculator)
+        self.assertRegex(str(err.exception), "^ValueError: (a, b|b, a)$")
+
+    def test_matrix(self):
+        """Option of the application prints the same total resources."""
+
+        application = Application()
+        application.init(["application.py", "data/tech_tree.txt"])
+        matrix = Application()
+        matrix.init(["application.py", "-m", "data/tech_tree.txt"])
+
+        for value in ["1 crafting_bench + 1 anvil_bench", "3 electric_extractor"]:
+            expected = application.process(value)
+            actual = matrix.process(value)
+            self.assertEqual(expected[-len(actual) :], actual)
+            self.assertEqual("TOTAL RESOURCES", actual[1])
+
+
+if __name__ == "__main__":
+    unittest.main()